@@ -0,0 +1,89 @@
+"""
+Chooses between Polya's Fourier-Motzkin ('fm') and polytope ('poly') solvers from cheap
+structural features of a problem.
+
+The model is a decision list read from backend_model.json: the first rule whose feature
+value is above (or at most) its threshold names the solver, and if none does the default is
+used. train_backend_model.py builds it from the logs poly_fm_compare writes.
+"""
+import json
+import os
+
+FEATURES = ['nvars', 'max_arity', 'nonlinear', 'dnf_width', 'quantifiers']
+
+default_model_file = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  'backend_model.json')
+
+CONST_KINDS = ('<const num>', '<const dec>')
+
+_models = {}
+
+
+class Features(object):
+    """
+    Counts the features of the declarations and assertions it is given. The counts can be
+    saved and restored around push and pop.
+    """
+
+    def __init__(self):
+        self.counts = {'nvars': 0, 'max_arity': 0, 'nonlinear': 0, 'quantifiers': 0}
+
+    def save(self):
+        return dict(self.counts)
+
+    def restore(self, counts):
+        self.counts = counts
+
+    def add_fun(self, smtfunnode):
+        arity = len(smtfunnode.sorts)
+        if arity == 0:
+            self.counts['nvars'] += 1
+        self.counts['max_arity'] = max(self.counts['max_arity'], arity)
+
+    def add_assertion(self, node):
+        seen = set()
+        to_visit = [node]
+        while to_visit:
+            cur = to_visit.pop()
+            if cur.id in seen:
+                continue
+            seen.add(cur.id)
+            if cur.kind in ('forall', 'exists'):
+                self.counts['quantifiers'] = 1
+            elif cur.kind == '^':
+                self.counts['nonlinear'] += 1
+            elif cur.kind == '*':
+                if sum(c.kind not in CONST_KINDS for c in cur.children) > 1:
+                    self.counts['nonlinear'] += 1
+            elif cur.kind == '/':
+                if any(c.kind not in CONST_KINDS for c in cur.children[1:]):
+                    self.counts['nonlinear'] += 1
+            to_visit.extend(cur.children)
+
+    def values(self, dnf_width):
+        """
+        Returns the feature values, given the number of Examples check-sat has to refute.
+        """
+        values = dict(self.counts)
+        values['dnf_width'] = dnf_width
+        return values
+
+
+def load_model(path=default_model_file):
+    if path not in _models:
+        with open(path) as f:
+            _models[path] = json.load(f)
+    return _models[path]
+
+
+def choose(values, model=None):
+    """
+    Returns 'fm' or 'poly' for the feature values, by the first matching rule of model.
+    """
+    if model is None:
+        model = load_model()
+    for rule in model['rules']:
+        above = values.get(rule['feature'], 0) > rule['threshold']
+        if above == (rule['op'] == '>'):
+            return rule['solver']
+    return model['default']
@@ -1,27 +1,48 @@
 smt_dir = '../keymaera_selection_small/'
 output = smt_dir + 'results.out'
-timeout = 3  # in seconds
+timeout = 3  # in seconds. Enforced as a CPU limit, and as a wall-clock limit wall_grace later.
+wall_grace = 1  # in seconds
+cpu_limit = None  # in seconds. If set, the CPU limit instead of timeout.
+memory_limit = None  # in megabytes. If set, runs whose resident set grows past it are stopped.
 force_fm = False  # If true, will force Polya to use Fourier Motzkin methods. Otherwise, will use
                   # polytope methods if available.
+workers = 1  # Number of worker processes. If greater than 1, files are run in parallel.
+lazy = False  # If true, disjunctive assertions are expanded one branch at a time at check-sat.
+branch_workers = 1  # Number of processes each check-sat uses to test disjuncts in parallel.
+parse_cache_dir = None  # If set, parsed files are cached in this directory across runs.
+parse_cache_size = 256  # Size cap of the parse cache, in megabytes.
+compact_ast = False  # If true, the terms of each file are kept in compact arrays rather than as
+                     # one object per node.
+result_cache_file = None  # If set, check-sat answers are cached in this sqlite file.
+auto_solver = False  # If true, each check-sat chooses FM or polytope methods with backend_select.
+show_stats = False  # If true, phase timers and counters are reported per file and in total.
+results_jsonl = None  # If set, one JSON line per file is written to this file as each finishes.
+                      # It is also the checkpoint --resume reads.
+compare_log = smt_dir + 'backend_compare.jsonl'  # Where poly_fm_compare logs features and times,
+                                                 # for train_backend_model.py.
 
 import smtlib2polya
+import argparse
+import json
+from parser2.parsecache import ParseCache
+from resultcache import ResultCache
+from stats import Stats
+import multiprocessing
+import select
 import sys
 import signal
-from os import listdir
-from os.path import isfile, join
+import supervise
+import zlib
+from os import listdir, rename
+from os.path import isfile, join, splitext
 from timeit import default_timer
+from topolya import TimerException
 stdout = sys.stdout
-
-
-class TimerException(Exception):
-    def __init__(self):
-        super(TimerException, self).__init__()
-
-
-def alert(num, frame):
-    print "Error: timed out!"
-    write_shell("Error: timed out!")
-    raise TimerException
+parse_cache = None
+result_cache = None
+solver_type = None
+jsonl_out = None
+resumed = {}  # The records of the files an earlier run finished, by file.
 
 
 def write_shell(s):
@@ -30,54 +51,175 @@ def write_shell(s):
     print s
     sys.stdout = o
 
-files = sorted([smt_dir+f for f in listdir(smt_dir)
-                if isfile(join(smt_dir, f)) and f[-4:] == 'smt2'])
-sys.stdout = open(output, 'w')
+
+def run_file(f, fm, solver=None, file_stats=None, features=None):
+    """
+    Runs Polya on f, in the child process supervised() starts. Returns the result, together with
+    file_stats and features, which the caller's copies do not see filled in.
+    """
+    try:
+        r = smtlib2polya.run_smt_file(f, fm, lazy=lazy, workers=branch_workers,
+                                      parse_cache=parse_cache, result_cache=result_cache,
+                                      timeout=cpu_limit or timeout, solver_type=solver,
+                                      stats=file_stats, features=features, compact=compact_ast)
+    except SystemExit as e:
+        # the file does not parse
+        print 'Error:', e
+        r = 0
+    return r, file_stats, features
+
+
+def supervised(f, fm, solver=None, file_stats=None, features=None):
+    """
+    Runs f under the time and memory limits. Returns the result, which is 1, -1 or 0, or
+    supervise.TIMEOUT or supervise.MEMOUT if a limit was reached; the output of the run; the
+    supervise.Outcome; and file_stats and features as the run filled them in.
+    """
+    outcome = supervise.run(run_file, (f, fm, solver, file_stats, features),
+                            wall=timeout + wall_grace, cpu=cpu_limit or timeout,
+                            memory=memory_limit and memory_limit * 1024 * 1024,
+                            cpu_exception=TimerException)
+    out = outcome.output
+    r = 0
+    if isinstance(outcome.value, tuple):
+        r, file_stats, features = outcome.value
+    if outcome.status in (supervise.TIMEOUT, supervise.MEMOUT):
+        r = outcome.status
+    elif file_stats and file_stats.error == TimerException.__name__:
+        # a timeout found in the result cache
+        r = supervise.TIMEOUT
+    elif outcome.status != supervise.OK:
+        out += 'Error: {0}\n'.format(outcome.value or outcome.status)
+        r = 0
+    if r == supervise.TIMEOUT:
+        out += 'Error: timed out!\n'
+        write_shell("Error: timed out!")
+    elif r == supervise.MEMOUT:
+        out += 'Error: out of memory!\n'
+        write_shell("Error: out of memory!")
+    return r, out, outcome, file_stats, features
+
+
+def backend_used(file_stats):
+    """
+    Returns the solver of a run: the one given, or with --auto the one backend_select chose for
+    its check-sats, 'fm+poly' if it chose both, and 'auto' if it never got to choose.
+    """
+    if solver_type != 'auto':
+        return solver_type or ('fm' if force_fm else 'poly')
+    chosen = [s for s in ('fm', 'poly')
+              if file_stats and file_stats.counts.get(s + ' check-sats')]
+    return '+'.join(chosen) or 'auto'
+
+
+def make_record(f, r, outcome, file_stats):
+    """
+    Returns the JSONL record of a run of f with the result r and the supervise.Outcome outcome.
+    """
+    status = r if r in (supervise.TIMEOUT, supervise.MEMOUT) else outcome.status
+    error = outcome.error or (file_stats.error if file_stats else None)
+    if status == supervise.OK and error:
+        status = supervise.ERROR
+    return {'file': f, 'result': r if r in (1, -1) else 0, 'status': status,
+            'wall': round(outcome.wall, 3), 'cpu': round(outcome.cpu, 3),
+            'max_rss_kb': outcome.max_rss_kb,
+            'backend': backend_used(file_stats),
+            'timeout': status == supervise.TIMEOUT,
+            'error': error,
+            'phases': dict((k, round(t, 4)) for k, t in file_stats.timers.items()),
+            'counts': file_stats.counts}
+
+
+def write_record(rec):
+    if jsonl_out and rec:
+        jsonl_out.write(json.dumps(rec, sort_keys=True) + '\n')
+        jsonl_out.flush()
+
+
+def shard_of(f, nshards):
+    """
+    Returns the shard of nshards that file f of smt_dir belongs to. It only depends on the name
+    of f within smt_dir, so every machine splits a directory the same way.
+    """
+    return (zlib.crc32(f[len(smt_dir):]) & 0xffffffff) % nshards
+
+
+def load_checkpoint(path):
+    """
+    Returns the records in the JSONL results at path, by file. A line cut short by the end of an
+    earlier run is dropped from the file, so that new records can be appended to it.
+    """
+    records = {}
+    lines = []
+    if not isfile(path):
+        return records
+    with open(path) as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            records[rec['file']] = rec
+            lines.append(line)
+    with open(path + '.tmp', 'w') as f:
+        f.writelines(lines)
+    rename(path + '.tmp', path)
+    return records
+
+
+def resumed_results():
+    results = {-1: 0, 0: 0, 1: 0, supervise.TIMEOUT: 0, supervise.MEMOUT: 0}
+    for rec in resumed.values():
+        if rec.get('status') in (supervise.TIMEOUT, supervise.MEMOUT):
+            results[rec['status']] += 1
+        else:
+            results[rec['result']] += 1
+    return results
+
+
+def summary(results):
+    return ('{0!s} successes, {1!s} failures, {2!s} errors, {3!s} timeouts and {4!s} '
+            'memouts.\n').format(results[1], results[-1], results[0],
+                                  results[supervise.TIMEOUT], results[supervise.MEMOUT])
+
 
 def poly_fm_compare():
     results = {-1: 0, 0: 0, 1: 0}
     results2 = {-1: 0, 0: 0, 1: 0}
     comps = {}
+    log = open(compare_log, 'a')
 
     timer = default_timer()
 
     for i, f in enumerate(files):
         write_shell('{0!s}: {1}'.format(i+1, f))
         print '\n{0!s}: {1}\n'.format(i+1, f)
-        r = 0
-        try:
-            signal.signal(signal.SIGALRM, alert)
-            signal.alarm(timeout)
-            r = smtlib2polya.run_smt_file(f, force_fm)
-            # except TimerException as e:
-            # 	print 'Error: timeout.'
-            # 	write_shell('Error: timeout.')
-            # 	results[0] += 1
-        except Exception as e:
-            print 'Error:', e.message
-            write_shell(e.message)
-            r = 0
-            raise e
-        finally:
-            results[r] += 1
-            comps[f] = [r]
+        times = []
+        r, out, outcome, _, features = supervised(f, force_fm, features={})
+        sys.stdout.write(out)
+        r = r if r in (1, -1) else 0
+        times.append(outcome.wall)
+        results[r] += 1
+        comps[f] = [r]
 
-        r = 0
-        try:
-            signal.signal(signal.SIGALRM, alert)
-            signal.alarm(timeout)
-            r = smtlib2polya.run_smt_file(f, not force_fm)
-            # except TimerException as e:
-            # 	print 'Error: timeout.'
-            # 	write_shell('Error: timeout.')
-            # 	results[0] += 1
-        except Exception as e:
-            print 'Error:', e.message
-            write_shell(e.message)
-            r = 0
-        finally:
-            results2[r] += 1
-            comps[f].append(r)
+        # a run that is stopped cannot report its features, so the other run's are kept too
+        r, out, outcome, _, features2 = supervised(f, not force_fm, features={})
+        features = features or features2
+        sys.stdout.write(out)
+        r = r if r in (1, -1) else 0
+        times.append(outcome.wall)
+        results2[r] += 1
+        comps[f].append(r)
+
+        # the first run used poly unless force_fm is set
+        order = ['fm', 'poly'] if force_fm else ['poly', 'fm']
+        entry = {'file': f, 'features': features}
+        for solver, r, t in zip(order, comps[f], times):
+            entry[solver] = r
+            entry[solver + '_time'] = round(t, 3)
+        log.write(json.dumps(entry, sort_keys=True) + '\n')
+        log.flush()
+    log.close()
 
     errors = {-1:"failed", 0:"error or time", 1:"succeeded"}
 
@@ -97,37 +239,256 @@ def poly_fm_compare():
     write_shell(s)
 
 def batch_test():
-    results = {-1: 0, 0: 0, 1: 0}
+    results = resumed_results()
+    total_stats = Stats()
 
     timer = default_timer()
 
     for i, f in enumerate(files):
         write_shell('{0!s}: {1}'.format(i+1, f))
         print '\n{0!s}: {1}\n'.format(i+1, f)
-        r = 0
+        # kept even without --stats, to tell a timeout found in the result cache from an error
+        file_stats = Stats()
+        r, out, outcome, file_stats, _ = supervised(f, force_fm, solver_type, file_stats)
+        sys.stdout.write(out)
+        results[r] += 1
+        if file_stats:
+            if show_stats:
+                print file_stats.report()
+            total_stats.merge(file_stats)
+        if jsonl_out:
+            write_record(make_record(f, r, outcome, file_stats))
+
+    timer = round(default_timer() - timer, 1)
+    s = 'Ran {0!s} examples in {1!s} seconds.\n'.format(len(files), timer)
+    if resumed:
+        s += 'Kept the results of {0!s} examples from an earlier run.\n'.format(len(resumed))
+    s += summary(results)
+    if show_stats:
+        s += total_stats.report() + '\n'
+    print s
+    write_shell(s)
+
+
+def worker_loop(conn):
+    """
+    Runs in a worker process: receives (index, file) tasks on conn until it receives None, and
+    answers each with (index, file, result, captured output, stats, JSONL record).
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while True:
         try:
-            signal.signal(signal.SIGALRM, alert)
-            signal.alarm(timeout)
-            r = smtlib2polya.run_smt_file(f, force_fm)
-            # except TimerException as e:
-            # 	print 'Error: timeout.'
-            # 	write_shell('Error: timeout.')
-            # 	results[0] += 1
-        except Exception as e:
-            print 'Error:', e.message
-            write_shell(e.message)
-            r = 0
-        finally:
-            results[r] += 1
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        i, f = task
+        file_stats = Stats()
+        r, out, outcome, file_stats, _ = supervised(f, force_fm, solver_type, file_stats)
+        if file_stats and show_stats:
+            out += file_stats.report() + '\n'
+        rec = make_record(f, r, outcome, file_stats) if jsonl_out else None
+        conn.send((i, f, r, out, file_stats, rec))
 
-    errors = {-1:"failed", 0:"error or time", 1:"succeeded"}
+
+class BatchWorker(object):
+    """
+    A worker process, together with the task it is currently running.
+    """
+
+    def __init__(self):
+        # anything still buffered would otherwise be written twice
+        sys.stdout.flush()
+        self.conn, child_conn = multiprocessing.Pipe()
+        # not a daemon, so that check-sat can start its own branch workers
+        self.process = multiprocessing.Process(target=worker_loop, args=(child_conn,))
+        self.process.start()
+        child_conn.close()
+        self.task = None
+        self.started = None
+        self.deadline = None
+
+    def fileno(self):
+        return self.conn.fileno()
+
+    def send(self, task):
+        self.task = task
+        self.started = default_timer()
+        # the worker's own limits should stop the run first; this only catches workers that hang
+        self.deadline = default_timer() + timeout + wall_grace + 1
+        self.conn.send(task)
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except IOError:
+            pass
+        self.process.join(1)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.conn.close()
+
+
+def parallel_batch_test(nworkers):
+    """
+    Like batch_test, but runs the files in a pool of nworkers worker processes. A worker that
+    does not answer within its timeout is killed and replaced.
+    """
+    results = resumed_results()
+    total_stats = Stats()
+
+    timer = default_timer()
+
+    def report(i, f, r, out, file_stats=None, rec=None):
+        write_shell('{0!s}: {1}'.format(i+1, f))
+        print '\n{0!s}: {1}\n'.format(i+1, f)
+        sys.stdout.write(out)
+        results[r] += 1
+        if file_stats:
+            total_stats.merge(file_stats)
+        write_record(rec)
+
+    def lost_record(w, error):
+        # for a worker that did not answer, so nothing is known but the wall time
+        status = supervise.TIMEOUT if error == TimerException.__name__ else supervise.CRASH
+        return {'file': w.task[1], 'result': 0, 'status': status,
+                'wall': round(default_timer() - w.started, 3), 'cpu': None, 'max_rss_kb': None,
+                'backend': backend_used(None),
+                'timeout': status == supervise.TIMEOUT, 'error': error,
+                'phases': {}, 'counts': {}}
+
+    pending = list(enumerate(files))[::-1]
+    pool = [BatchWorker() for _ in range(max(1, min(nworkers, len(files))))]
+    try:
+        while pending or any(w.task for w in pool):
+            for w in pool:
+                if w.task is None and pending:
+                    w.send(pending.pop())
+            busy = [w for w in pool if w.task]
+            wait = max(0, min(w.deadline for w in busy) - default_timer())
+            for w in select.select(busy, [], [], wait)[0]:
+                try:
+                    i, f, r, out, file_stats, rec = w.conn.recv()
+                except EOFError:
+                    (i, f), r, out, file_stats = w.task, 0, 'Error: worker died\n', None
+                    rec = lost_record(w, 'WorkerDied')
+                    w.kill()
+                    pool[pool.index(w)] = BatchWorker()
+                report(i, f, r, out, file_stats, rec)
+                w.task = None
+            now = default_timer()
+            for k, w in enumerate(pool):
+                if w.task and w.deadline <= now:
+                    i, f = w.task
+                    rec = lost_record(w, TimerException.__name__)
+                    w.kill()
+                    pool[k] = BatchWorker()
+                    write_shell("Error: timed out!")
+                    report(i, f, supervise.TIMEOUT, 'Error: timed out!\n', rec=rec)
+    finally:
+        for w in pool:
+            w.stop()
 
     timer = round(default_timer() - timer, 1)
     s = 'Ran {0!s} examples in {1!s} seconds.\n'.format(len(files), timer)
-    s += '{0!s} successes, {1!s} failures, and {2!s} errors.\n'.format(
-        results[1], results[-1], results[0]
-    )
+    if resumed:
+        s += 'Kept the results of {0!s} examples from an earlier run.\n'.format(len(resumed))
+    s += summary(results)
+    if show_stats:
+        s += total_stats.report() + '\n'
     print s
     write_shell(s)
 
-batch_test()
\ No newline at end of file
+
+if __name__ == '__main__':
+    aparser = argparse.ArgumentParser(description="Run Polya on all .smt2 files in smt_dir.")
+    aparser.add_argument('-j', dest='workers', type=int, default=workers,
+                         help="number of worker processes (default: {0})".format(workers))
+    aparser.add_argument('--lazy', action='store_true', default=lazy,
+                         help="expand disjunctions one branch at a time at check-sat")
+    aparser.add_argument('--branch-workers', dest='branch_workers', type=int,
+                         default=branch_workers,
+                         help="number of processes each check-sat uses to test disjuncts")
+    aparser.add_argument('--parse-cache', dest='parse_cache_dir', metavar='DIR',
+                         default=parse_cache_dir,
+                         help="cache parsed files in DIR across runs")
+    aparser.add_argument('--parse-cache-size', dest='parse_cache_size', metavar='MB', type=int,
+                         default=parse_cache_size,
+                         help="size cap of the parse cache (default: {0})".format(parse_cache_size))
+    aparser.add_argument('--compact-ast', dest='compact_ast', action='store_true',
+                         default=compact_ast,
+                         help="keep the terms of each file in compact arrays")
+    aparser.add_argument('--result-cache', dest='result_cache_file', metavar='FILE',
+                         default=result_cache_file,
+                         help="cache check-sat answers in the sqlite database FILE")
+    aparser.add_argument('--auto', action='store_true', default=auto_solver,
+                         help="choose the FM or polytope solver for each problem")
+    aparser.add_argument('--compare', action='store_true',
+                         help="run every file with both solvers, and log the features and times "
+                              "to {0}".format(compare_log))
+    aparser.add_argument('--stats', action='store_true', default=show_stats,
+                         help="report phase timers and counters per file and in total")
+    aparser.add_argument('--jsonl', dest='results_jsonl', metavar='FILE', default=results_jsonl,
+                         help="write one JSON line per file to FILE as each finishes")
+    aparser.add_argument('--cpu-limit', dest='cpu_limit', metavar='SEC', type=float,
+                         default=cpu_limit,
+                         help="CPU time limit per file (default: the timeout, {0})".format(timeout))
+    aparser.add_argument('--memory-limit', dest='memory_limit', metavar='MB', type=int,
+                         default=memory_limit,
+                         help="resident memory limit per file (default: none)")
+    aparser.add_argument('--resume', action='store_true',
+                         help="skip the files that already have a record in the --jsonl file, "
+                              "and append to it")
+    aparser.add_argument('--shard', metavar='I/N',
+                         help="only run the files of shard I of N (0 <= I < N)")
+    args = aparser.parse_args()
+    if args.resume and not args.results_jsonl:
+        aparser.error("--resume needs --jsonl")
+    shard = None
+    if args.shard:
+        try:
+            shard = tuple(int(k) for k in args.shard.split('/'))
+            if len(shard) != 2 or not 0 <= shard[0] < shard[1]:
+                raise ValueError
+        except ValueError:
+            aparser.error("--shard expects I/N with 0 <= I < N")
+        # shards are usually run side by side in one directory
+        output = '{0}.{1}of{2}{3}'.format(splitext(output)[0], shard[0], shard[1],
+                                         splitext(output)[1])
+    lazy = args.lazy
+    cpu_limit = args.cpu_limit
+    memory_limit = args.memory_limit
+    show_stats = args.stats
+    if args.auto:
+        solver_type = 'auto'
+    branch_workers = args.branch_workers
+    compact_ast = args.compact_ast
+    if args.parse_cache_dir:
+        parse_cache = ParseCache(args.parse_cache_dir, args.parse_cache_size * 1024 * 1024)
+    if args.result_cache_file:
+        result_cache = ResultCache(args.result_cache_file)
+
+    files = sorted([smt_dir+f for f in listdir(smt_dir)
+                    if isfile(join(smt_dir, f)) and f[-4:] == 'smt2'])
+    if shard:
+        files = [f for f in files if shard_of(f, shard[1]) == shard[0]]
+    if args.resume:
+        wanted = set(files)
+        resumed = dict((f, rec) for f, rec in load_checkpoint(args.results_jsonl).items()
+                       if f in wanted)
+        files = [f for f in files if f not in resumed]
+    sys.stdout = open(output, 'a' if args.resume else 'w')
+    if args.results_jsonl:
+        jsonl_out = open(args.results_jsonl, 'a' if args.resume else 'w')
+
+    if args.compare:
+        poly_fm_compare()
+    elif args.workers > 1:
+        parallel_batch_test(args.workers)
+    else:
+        batch_test()
\ No newline at end of file
@@ -0,0 +1,114 @@
+"""
+Generators of scalable SMT-LIB v2 problems in the fragment topolya translates. Each takes a
+size n and returns the text of an unsatisfiable problem, whose size grows linearly with n.
+"""
+import fractions
+import random
+
+HEADER = '(set-logic {0})\n(set-info :status unsat)\n'
+
+
+def declare(names, arity=0):
+    return ''.join('(declare-fun {0} ({1}) Real)\n'.format(name, ' '.join(['Real'] * arity))
+                   for name in names)
+
+
+def linear_chain(n):
+    """
+    x0 < x1 < ... < xn < x0, one assertion per link.
+    """
+    xs = ['x{0}'.format(i) for i in range(n + 1)]
+    s = HEADER.format('QF_LRA') + declare(xs)
+    for a, b in zip(xs, xs[1:] + xs[:1]):
+        s += '(assert (< {0} {1}))\n'.format(a, b)
+    return s + '(check-sat)\n(exit)\n'
+
+
+def wide_disjunction(n):
+    """
+    x lies in one of n intervals, none of which is consistent with a bound on x.
+    """
+    s = HEADER.format('QF_LRA') + declare(['x'])
+    s += '(assert (or\n'
+    for i in range(n):
+        s += '  (and (< {0} x) (< x {1}))\n'.format(i, i + 1)
+    s += '))\n'
+    s += '(assert (< x 0))\n'
+    return s + '(check-sat)\n(exit)\n'
+
+
+def deep_let(n):
+    """
+    n nested lets, each adding 1 to the last, so that x + n < x.
+    """
+    s = HEADER.format('QF_LRA') + declare(['x'])
+    body = '(< a{0} x)'.format(n)
+    for i in range(n, 0, -1):
+        prev = 'a{0}'.format(i - 1) if i > 1 else 'x'
+        body = '(let ((a{0} (+ {1} 1))) {2})'.format(i, prev, body)
+    s += '(assert {0})\n'.format(body)
+    return s + '(check-sat)\n(exit)\n'
+
+
+def uf_applications(n):
+    """
+    f(x1) = f(x0) + 1, ..., f(xn) = f(xn-1) + 1, and f(xn) <= f(x0).
+    """
+    xs = ['x{0}'.format(i) for i in range(n + 1)]
+    s = HEADER.format('QF_UFLRA') + declare(xs) + declare(['f'], 1)
+    for a, b in zip(xs, xs[1:]):
+        s += '(assert (= (f {1}) (+ (f {0}) 1)))\n'.format(a, b)
+    s += '(assert (<= (f {0}) (f {1})))\n'.format(xs[-1], xs[0])
+    return s + '(check-sat)\n(exit)\n'
+
+
+def forall_axioms(n):
+    """
+    n functions with the axioms f_i(u) < f_i+1(u) for all u, and f_n(x) <= f_1(x). n must be
+    at least 2, since a single function has no axioms.
+    """
+    if n < 2:
+        raise ValueError('forall_axioms needs n >= 2, not {0}'.format(n))
+    fs = ['f{0}'.format(i) for i in range(1, n + 1)]
+    s = HEADER.format('UFLRA') + declare(['x']) + declare(fs, 1)
+    for a, b in zip(fs, fs[1:]):
+        s += '(assert (forall ((u Real)) (< ({0} u) ({1} u))))\n'.format(a, b)
+    s += '(assert (<= ({0} x) ({1} x)))\n'.format(fs[-1], fs[0])
+    return s + '(check-sat)\n(exit)\n'
+
+
+def big_rationals(n, digits=30, seed=0):
+    """
+    x_i+1 <= x_i + c_i for n constants c_i of about digits digits, written as fractions and
+    decimals, and x_n > x_0 + the sum of the c_i. The fractions share a few denominators, so
+    that the sum stays about as long as the constants.
+    """
+    rand = random.Random(seed)
+    dens = [rand.randint(10 ** (digits - 1), 10 ** digits) for _ in range(3)]
+    xs = ['x{0}'.format(i) for i in range(n + 1)]
+    s = HEADER.format('QF_LRA') + declare(xs)
+    total = fractions.Fraction(0)
+    for i, (a, b) in enumerate(zip(xs, xs[1:])):
+        num = rand.randint(10 ** (digits - 1), 10 ** digits)
+        if i % 2:
+            den = rand.choice(dens)
+            c = fractions.Fraction(num, den)
+            const = '(/ {0} {1})'.format(num, den)
+        else:
+            c = fractions.Fraction(num, 10 ** (digits // 2))
+            const = '{0}.{1}'.format(str(num)[:-(digits // 2)], str(num)[-(digits // 2):])
+        total += c
+        s += '(assert (<= {0} (+ {1} {2})))\n'.format(b, a, const)
+    s += '(assert (> {0} (+ {1} (/ {2} {3}))))\n'.format(xs[-1], xs[0], total.numerator,
+                                                       total.denominator)
+    return s + '(check-sat)\n(exit)\n'
+
+
+FAMILIES = [
+    ('chain', linear_chain),
+    ('disjunction', wide_disjunction),
+    ('let', deep_let),
+    ('uf', uf_applications),
+    ('forall', forall_axioms),
+    ('rationals', big_rationals),
+]
@@ -0,0 +1,159 @@
+"""
+Times each stage of the pipeline on the generated problems of benchmarks.generators: the
+tokenizer, the rest of the parser, the translation to Polya (with the normal forms and copying
+Examples) and Polya's tests.
+
+Each problem is run repeat times, each in a fresh child process under supervise, and every
+stage keeps its fastest time. --save writes the timings as JSON, and --baseline compares them
+with timings saved earlier.
+
+Usage, from the repository root:
+  python -m benchmarks.run [--families chain,let] [--sizes 10,100] [--repeat 3]
+                           [--timeout 60] [--save new.json] [--baseline old.json]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import smtlib2polya
+import supervise
+from benchmarks.generators import FAMILIES
+from stats import Stats
+from topolya import TimerException
+
+STAGES = ['tokenize', 'parse', 'translate', 'solve']
+# The stats phases that make up each stage.
+STAGE_PHASES = {
+    'tokenize': ['tokenize'],
+    'parse': ['parse'],
+    'translate': ['translate', 'pnf', 'dnf', 'deepcopy'],
+    'solve': ['test'],
+}
+
+
+def run_once(path, force_fm, compact=False):
+    stats = Stats()
+    r = smtlib2polya.run_smt_file(path, force_fm, stats=stats, compact=compact)
+    return r, stats
+
+
+def time_problem(path, repeat, timeout, force_fm=False, compact=False):
+    """
+    Returns a dictionary with the fastest time of each stage over repeat runs of path, the
+    result and the status of the last run. compact is passed on to session.Session.
+    """
+    best = dict((stage, None) for stage in STAGES)
+    case = {'result': 0, 'status': supervise.OK}
+    for _ in range(repeat):
+        outcome = supervise.run(run_once, (path, force_fm, compact), wall=timeout, cpu=timeout,
+                                cpu_exception=TimerException)
+        case['status'] = outcome.status
+        if not isinstance(outcome.value, tuple):
+            break
+        r, stats = outcome.value
+        case['result'] = r
+        if stats.error:
+            case['status'] = stats.error
+        for stage in STAGES:
+            t = sum(stats.timers.get(phase, 0) for phase in STAGE_PHASES[stage])
+            if best[stage] is None or t < best[stage]:
+                best[stage] = t
+        if outcome.status != supervise.OK:
+            break
+    case.update(best)
+    if all(best[stage] is not None for stage in STAGES):
+        case['total'] = sum(best.values())
+    return case
+
+
+def format_time(t):
+    return '-' if t is None else '{0:.4f}'.format(t)
+
+
+def report(cases, baseline=None):
+    """
+    Returns the table of cases as lines of text, with the ratio to the baseline after each time
+    if there is one.
+    """
+    old = {}
+    if baseline:
+        old = dict(((c['family'], c['size']), c) for c in baseline['cases'])
+    columns = STAGES + ['total']
+    lines = ['{0:<12}{1:>7}'.format('family', 'size') +
+             ''.join('{0:>18}'.format(c) for c in columns) + '  result']
+    for case in cases:
+        base = old.get((case['family'], case['size']))
+        cells = []
+        for c in columns:
+            cell = format_time(case.get(c))
+            if base and case.get(c) is not None and base.get(c):
+                cell += ' ({0:.2f}x)'.format(case[c] / base[c])
+            cells.append('{0:>18}'.format(cell))
+        status = str(case['result'])
+        if case['status'] != supervise.OK:
+            status += ' ' + case['status']
+        lines.append('{0:<12}{1:>7}'.format(case['family'], case['size']) + ''.join(cells) +
+                     '  ' + status)
+    return lines
+
+
+if __name__ == '__main__':
+    names = [name for name, _ in FAMILIES]
+    parser = argparse.ArgumentParser(description="Time the pipeline on generated problems.")
+    parser.add_argument('--families', default=','.join(names),
+                        help="comma-separated families to run (default: {0})".format(
+                            ','.join(names)))
+    parser.add_argument('--sizes', default='10,100',
+                        help="comma-separated problem sizes (default: 10,100)")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="runs per problem; the fastest counts (default: 3)")
+    parser.add_argument('--timeout', type=float, default=60,
+                        help="time limit per run in seconds (default: 60)")
+    parser.add_argument('-f', action='store_true', help="force FM")
+    parser.add_argument('--compact-ast', action='store_true',
+                        help="keep the terms in compact arrays")
+    parser.add_argument('--keep', metavar='DIR',
+                        help="write the problems to DIR and keep them")
+    parser.add_argument('--save', metavar='FILE', help="write the timings to FILE as JSON")
+    parser.add_argument('--baseline', metavar='FILE',
+                        help="compare with timings written by --save")
+    args = parser.parse_args()
+
+    generators = dict(FAMILIES)
+    families = args.families.split(',')
+    for family in families:
+        if family not in generators:
+            parser.error("unknown family: {0}".format(family))
+    sizes = [int(n) for n in args.sizes.split(',')]
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    directory = args.keep or tempfile.mkdtemp(prefix='polya-bench-')
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    cases = []
+    try:
+        for family in families:
+            for n in sizes:
+                path = os.path.join(directory, '{0}-{1}.smt2'.format(family, n))
+                with open(path, 'w') as f:
+                    f.write(generators[family](n))
+                case = time_problem(path, args.repeat, args.timeout, args.f, args.compact_ast)
+                case.update(family=family, size=n)
+                cases.append(case)
+                sys.stderr.write(report([case], baseline)[1] + '\n')
+    finally:
+        if not args.keep:
+            shutil.rmtree(directory)
+
+    print '\n'.join(report(cases, baseline))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'repeat': args.repeat, 'force_fm': args.f, 'compact': args.compact_ast,
+                       'cases': cases}, f, indent=2, separators=(',', ': '), sort_keys=True)
+            f.write('\n')
@@ -0,0 +1,122 @@
+"""
+Hash-consed construction of Polya terms.
+
+A TermTable returns the same term object every time the same operation is applied to the same
+arguments, so a subterm that occurs in many assertions is built once. Arguments are compared by
+identity, since Polya terms overload ==, and numbers by value. As the leaves (variables and
+function symbols) are already unique, terms built bottom-up through one table are shared
+whenever they are structurally equal.
+
+make_sum and make_product build an n-ary sum or product in one step, as Polya represents them,
+rather than by folding the binary operators.
+
+make_quotient divides numbers exactly, as fractions, rather than by the integer division of
+Python 2.
+"""
+import fractions
+import numbers
+
+import polya.main.terms as terms
+
+
+def make_sum(args):
+    """
+    Returns the sum of args, a list of numbers and Polya terms, as a number or a term. The
+    numbers are added up into one constant.
+    """
+    const = 0
+    summands = []
+    for a in args:
+        if isinstance(a, numbers.Rational):
+            const += a
+        elif isinstance(a, terms.STerm):
+            summands.append(a)
+        else:
+            summands.append(terms.STerm(1, a))
+    if not summands:
+        return const
+    if const != 0:
+        summands.append(terms.STerm(const, terms.one))
+    if len(summands) == 1:
+        s = summands[0]
+        return s.term if s.coeff == 1 else s
+    return terms.AddTerm(summands)
+
+
+def make_product(args):
+    """
+    Returns the product of args, a list of numbers and Polya terms, as a number or a term. The
+    numbers and the coefficients of scalar multiples are multiplied out into one coefficient.
+    """
+    coeff = 1
+    factors = []
+    for a in args:
+        if isinstance(a, numbers.Rational):
+            coeff *= a
+        elif isinstance(a, terms.STerm):
+            coeff *= a.coeff
+            if not isinstance(a.term, terms.One):
+                factors.append(a.term)
+        else:
+            factors.append(a)
+    if not factors or coeff == 0:
+        return coeff
+    if len(factors) == 1:
+        t = factors[0]
+    else:
+        t = terms.MulTerm([terms.MulPair(f, 1) for f in factors])
+    return t if coeff == 1 else terms.STerm(coeff, t)
+
+
+def make_quotient(args):
+    """
+    Returns args[0] divided by each of the rest of args in turn. A number divided by a number is
+    a Fraction.
+    """
+    q = args[0]
+    for a in args[1:]:
+        if isinstance(q, numbers.Rational) and isinstance(a, numbers.Rational):
+            q = fractions.Fraction(q, a)
+        else:
+            q = q / a
+    return q
+
+
+class TermTable(object):
+    """
+    The terms built so far, keyed by their operation and the identities of their arguments.
+    The table keeps the operations and arguments alive, so that their identities are not
+    reused.
+    """
+
+    def __init__(self):
+        self.terms = {}
+        self.canonical = {}
+        self.hits = 0
+        self.misses = 0
+
+    def build(self, op, make, args):
+        """
+        Returns make(args), or the term it returned when first called with op and the same
+        arguments. op names the operation: a string such as an SMT kind, or an object such as
+        a Polya Func, which is compared by identity.
+        """
+        key = (op if isinstance(op, basestring) else id(op),)
+        key += tuple(('#', a) if isinstance(a, numbers.Rational) else id(a) for a in args)
+        entry = self.terms.get(key)
+        if entry is not None:
+            self.hits += 1
+            return entry[2]
+        self.misses += 1
+        t = make(args)
+        self.terms[key] = (op, args, t)
+        return t
+
+    def canonize(self, t):
+        """
+        Returns t.canonize(), computed once for each term object.
+        """
+        entry = self.canonical.get(id(t))
+        if entry is None:
+            entry = self.canonical[id(t)] = (t, t.canonize())
+        return entry[1]
@@ -18,4 +18,4 @@
 # along with ddSMT.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-__all__ = ["smtparser", "ddsmtparser"]
+__all__ = ["smtparser", "ddsmtparser", "parsecache", "astarray"]
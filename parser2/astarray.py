@@ -0,0 +1,271 @@
+"""
+A compact store for the terms of parsed SMT-LIB v2 commands.
+
+Every term node of ddsmtparser is a Python object with its own list of children. An ASTStore
+instead keeps the inner nodes of terms (function applications, lets, variable bindings,
+quantifiers and annotations) as rows of a few arrays: the kind as a small integer code, the
+sort and the function symbol, bound variable, sorted variables or attributes as indices into a
+table of objects, and the children as a slice of one flat array of references. The leaves
+(constants, variables and function symbols, which the parser already shares) and the sorts stay
+objects, and are kept once in the object table. Millions of nodes then take a few dozen bytes
+each, and the garbage collector has only the leaves to track.
+
+A NodeView stands for a row. It has the kind, sort, children and id of the node it replaces, so
+that topolya and backend_select read it like one.
+
+A parser given a store, as DDSMTParser(lean=True, store=ASTStore()), adds each node to it as
+soon as the node is built, and passes a view on in its place. The object tree of a term thus
+never exists as a whole, however large the term. compact(cmds) instead puts the terms of
+commands that were parsed as objects in a store, one command at a time.
+"""
+
+from array import array
+
+from parser2 import ddsmtparser
+from parser2.ddsmtparser import SMTFunAppNode, SMTLetNode, SMTVarBindNode, \
+        SMTForallExistsNode, SMTAnnNode
+
+# The kinds, by their codes. All of them are fixed in ddsmtparser, so the table is never
+# extended and can be shared by threads.
+KINDS = ddsmtparser.g_kinds
+KIND_CODES = ddsmtparser.g_kind_codes
+
+# The classes of nodes a row can stand for, by their tags.
+FUNAPP, LET, VARB, QUANT, ANN = range(5)
+TAGS = {SMTFunAppNode: FUNAPP, SMTLetNode: LET, SMTVarBindNode: VARB,
+        SMTForallExistsNode: QUANT, SMTAnnNode: ANN}
+# The attribute of each class that is kept in the object table.
+EXTRAS = {FUNAPP: 'fun', VARB: 'var', QUANT: 'svars', ANN: 'attributes'}
+
+
+def is_inner(node):
+    """
+    Returns True if node is kept as a row, and False if it is a leaf. A named annotation is
+    also a function symbol, and stays an object.
+    """
+    return type(node) in TAGS and node.kind in KIND_CODES
+
+
+class ASTStore(object):
+    """
+    The rows of the terms added so far. A reference is the number of a row if it is at least
+    0, and otherwise stands for the object at index -1 - ref of the object table.
+    """
+
+    def __init__(self):
+        self.tags = array('B')
+        self.kinds = array('H')
+        self.sorts = array('i')     # object index, or -1 for no sort
+        self.extras = array('i')    # object index of the fun, var, svars or attributes
+        self.starts = array('L', [0])   # children of row i: refs[starts[i]:starts[i + 1]]
+        self.refs = array('i')
+        self.objects = []
+        self.object_index = {}  # id of an object -> its index in objects
+
+    def __len__(self):
+        return len(self.tags)
+
+    def __getstate__(self):
+        # the ids of the objects are only valid in this process
+        state = dict(self.__dict__)
+        del state['object_index']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.object_index = dict((id(o), i) for i, o in enumerate(self.objects))
+
+    def add_object(self, obj):
+        i = self.object_index.get(id(obj))
+        if i is None:
+            i = self.object_index[id(obj)] = len(self.objects)
+            self.objects.append(obj)
+        return i
+
+    def add(self, node):
+        """
+        Adds the term node, and returns a view of it, or node itself if it is a leaf. Nodes
+        shared within the term are added once, and views of this store in it are kept as they
+        are, so a parser can add each node as it builds it, see ddsmtparser.SMTFormula. The
+        tree is walked in a loop rather than by recursion, so deep nesting does not reach the
+        recursion limit.
+        """
+        if not is_inner(node):
+            return node
+        rows = {}   # id of an inner node of this term -> its row
+        results = []
+        to_visit = [(node, False)]
+        while to_visit:
+            cur, done = to_visit.pop()
+            if type(cur) is NodeView and cur.store is self:
+                results.append(cur.row)
+            elif not is_inner(cur):
+                results.append(-1 - self.add_object(cur))
+            elif done:
+                tag = TAGS[type(cur)]
+                n = len(cur.children)
+                self.refs.extend(results[len(results) - n:])
+                del results[len(results) - n:]
+                row = rows[id(cur)] = len(self.tags)
+                self.tags.append(tag)
+                self.kinds.append(KIND_CODES[cur.kind])
+                self.sorts.append(-1 if cur.sort is None else self.add_object(cur.sort))
+                self.extras.append(
+                        self.add_object(getattr(cur, EXTRAS[tag])) if tag in EXTRAS else -1)
+                self.starts.append(len(self.refs))
+                results.append(row)
+            elif id(cur) in rows:
+                results.append(rows[id(cur)])
+            else:
+                to_visit.append((cur, True))
+                to_visit.extend((c, False) for c in reversed(cur.children))
+        assert (len(results) == 1)
+        return self.node(results[0])
+
+    def node(self, ref):
+        return NodeView(self, ref) if ref >= 0 else self.objects[-1 - ref]
+
+    def children(self, row):
+        return [self.node(r) for r in self.refs[self.starts[row]:self.starts[row + 1]]]
+
+    def extra(self, row, tag):
+        if self.tags[row] != tag:
+            raise AttributeError(EXTRAS[tag])
+        return self.objects[self.extras[row]]
+
+    def to_string(self, row):
+        """
+        Returns the SMT-LIB text of row, as str() of the node it stands for does.
+        """
+        strings = []
+        to_visit = [(row, False)]
+        while to_visit:
+            ref, done = to_visit.pop()
+            if ref < 0:
+                strings.append(str(self.objects[-1 - ref]))
+                continue
+            begin, end = self.starts[ref], self.starts[ref + 1]
+            if not done:
+                to_visit.append((ref, True))
+                to_visit.extend((r, False) for r in reversed(self.refs[begin:end]))
+                continue
+            cs = strings[len(strings) - (end - begin):]
+            del strings[len(strings) - (end - begin):]
+            tag = self.tags[ref]
+            if tag == FUNAPP:
+                s = "({} {})".format(self.objects[self.extras[ref]], " ".join(cs))
+            elif tag == LET:
+                s = "({} ({}) {})".format(KINDS[self.kinds[ref]], " ".join(cs[:-1]), cs[-1])
+            elif tag == VARB:
+                s = "({} {})".format(self.objects[self.extras[ref]].name, cs[0])
+            elif tag == QUANT:
+                s = "({} ({}) {})".format(
+                        KINDS[self.kinds[ref]],
+                        " ".join("({} {!s})".format(v.var.name, v.var.sort)
+                                 for v in self.objects[self.extras[ref]]),
+                        cs[0])
+            else:
+                s = "(! {} {})".format(
+                        cs[0], " ".join(str(a) for a in self.objects[self.extras[ref]]))
+            strings.append(s)
+        assert (len(strings) == 1)
+        return strings[0]
+
+
+class NodeView(object):
+    """
+    A row of an ASTStore, read like the node it stands for. Its id is negative, so that it
+    differs from the ids of SMTNodes, and is the same for every view of the row.
+    """
+
+    __slots__ = ['store', 'row']
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+
+    @property
+    def id(self):
+        return -1 - self.row
+
+    @property
+    def kind(self):
+        return KINDS[self.store.kinds[self.row]]
+
+    @property
+    def sort(self):
+        i = self.store.sorts[self.row]
+        return self.store.objects[i] if i >= 0 else None
+
+    @property
+    def children(self):
+        return self.store.children(self.row)
+
+    @property
+    def fun(self):
+        return self.store.extra(self.row, FUNAPP)
+
+    @property
+    def var(self):
+        return self.store.extra(self.row, VARB)
+
+    @property
+    def svars(self):
+        return self.store.extra(self.row, QUANT)
+
+    @property
+    def attributes(self):
+        return self.store.extra(self.row, ANN)
+
+    def __eq__(self, other):
+        return isinstance(other, NodeView) and \
+                self.store is other.store and self.row == other.row
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self.store), self.row))
+
+    def __str__(self):
+        return self.store.to_string(self.row)
+
+    def is_const(self):
+        return False
+
+    def is_fun(self):
+        return False
+
+    def is_let(self):
+        return self.store.tags[self.row] == LET
+
+    def is_varb(self):
+        return self.store.tags[self.row] == VARB
+
+    def get_subst(self):
+        return self
+
+    def is_subst(self):
+        return False
+
+
+def compact_child(store, c):
+    if isinstance(c, list):
+        return [compact_child(store, cc) for cc in c]
+    return store.add(c) if is_inner(c) else c
+
+
+def compact(cmds, store=None):
+    """
+    Yields the commands of cmds, a generator such as DDSMTParser.iter_commands, with their
+    terms replaced by views of store (a new ASTStore if it is None). The nodes of a command can
+    be freed once it has been read, as long as nothing else keeps them. cmds is closed when
+    this generator is.
+    """
+    store = store if store is not None else ASTStore()
+    try:
+        for cmd in cmds:
+            cmd.children = [compact_child(store, c) for c in cmd.children]
+            yield cmd
+    finally:
+        cmds.close()
@@ -18,6 +18,8 @@
 # along with ddSMT.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import itertools
+
 from parser2.smtparser import SMTParser, SMTParseException
 
 KIND_ANNFUN    = "<annotated fun symbol>"
@@ -142,7 +144,7 @@ g_const_kinds = \
     [ KIND_CONST, KIND_CONSTB, KIND_CONSTD, KIND_CONSTN, KIND_CONSTH, 
       KIND_CONSTS ]
 
-g_fun_kinds   = \
+g_fun_kinds   = frozenset (
     [ KIND_ABS,    KIND_ADD,    KIND_AND,    KIND_BVADD,  KIND_BVAND,
       KIND_BVASHR, KIND_BVCOMP, KIND_BVLSHR, KIND_BVMUL,  KIND_BVNAND, 
       KIND_BVNEG,  KIND_BVNOR,  KIND_BVNOT,  KIND_BVOR,   KIND_BVSDIV,
@@ -155,7 +157,7 @@ g_fun_kinds   = \
       KIND_NEG,    KIND_NOT,    KIND_OR,     KIND_RDIV,   KIND_REP,
       KIND_ROL,    KIND_ROR,    KIND_SELECT, KIND_SEXT,   KIND_STORE,
       KIND_SUB,    KIND_TOI,    KIND_TOR,    KIND_XOR,    KIND_ZEXT,
-      KIND_POW]
+      KIND_POW])
 
 g_cmd_kinds   = \
     [ KIND_ASSERT,   KIND_CHECKSAT, KIND_DECLFUN,   KIND_DEFFUN, 
@@ -164,6 +166,86 @@ g_cmd_kinds   = \
       KIND_GETINFO,  KIND_EXIT,     KIND_PUSH,      KIND_POP,
       KIND_SETLOGIC, KIND_SETINFO,  KIND_SETOPT,    KIND_SIMPLIFY ]
 
+# all kinds, interned as small integer codes: g_kinds[g_kind_codes[kind]] == kind
+g_kinds = sorted (set (
+    [v for k, v in list(globals().items()) if k.startswith ("KIND_")]))
+g_kind_codes = dict ((kind, code) for code, kind in enumerate (g_kinds))
+
+# how the arguments of a predefined function are checked
+ARGS_BOOL, ARGS_INT, ARGS_REAL, ARGS_NUM, ARGS_BV, ARGS_EQ, ARGS_BVEQ, \
+        ARGS_ARRAY, ARGS_ITE = range (9)
+# how the sort of an application of a predefined function is found
+SORT_BOOL, SORT_INT, SORT_REAL, SORT_NUM, SORT_FIRST, SORT_ITE, SORT_SELECT, \
+        SORT_CONC, SORT_EXTR, SORT_REP, SORT_EXT, SORT_BV1 = range (12)
+
+
+def _signatures ():
+    sigs = dict ((kind, [None, None, None, None]) for kind in g_fun_kinds)
+    def put (i, value, kinds):
+        for kind in kinds:
+            sigs[kind][i] = value
+    # number of args
+    put (0, 1, (KIND_ABS, KIND_BVNEG, KIND_BVNOT, KIND_EXTR, KIND_ISI,
+                KIND_NOT, KIND_NEG,   KIND_TOI,   KIND_TOR,  KIND_REP,
+                KIND_ROL, KIND_ROR,   KIND_SEXT,  KIND_ZEXT))
+    put (0, 2, (KIND_BVADD,  KIND_BVAND,  KIND_BVASHR, KIND_BVCOMP, 
+                KIND_BVLSHR, KIND_BVMUL,  KIND_BVNAND, KIND_BVNOR,
+                KIND_BVOR,   KIND_BVSDIV, KIND_BVSGE,  KIND_BVSGT,
+                KIND_BVSHL,  KIND_BVSLE,  KIND_BVSLT,  KIND_BVSMOD,
+                KIND_BVSREM, KIND_BVSUB,  KIND_BVUGE,  KIND_BVUGT,
+                KIND_BVUDIV, KIND_BVULE,  KIND_BVULT,  KIND_BVUREM,
+                KIND_BVXNOR, KIND_BVXOR,  KIND_CONC,   KIND_MOD,
+                KIND_SELECT))
+    put (0, 3, (KIND_ITE, KIND_STORE))
+    # number of indices
+    put (1, 2, (KIND_EXTR,))
+    put (1, 1, (KIND_REP, KIND_ROL, KIND_ROR, KIND_SEXT, KIND_ZEXT))
+    # args
+    put (2, ARGS_BOOL, (KIND_AND, KIND_IMPL, KIND_NOT, KIND_OR, KIND_XOR))
+    put (2, ARGS_INT, (KIND_ABS, KIND_DIV, KIND_MOD, KIND_TOR))
+    put (2, ARGS_REAL, (KIND_RDIV, KIND_ISI, KIND_TOI))
+    put (2, ARGS_NUM, (KIND_ADD, KIND_GE, KIND_GT, KIND_LE, KIND_LT, KIND_MUL, 
+                       KIND_NEG, KIND_SUB, KIND_POW))
+    put (2, ARGS_BV, (KIND_CONC, KIND_EXTR, KIND_REP,   KIND_ROL,  KIND_ROR, 
+                      KIND_SEXT, KIND_ZEXT, KIND_BVNEG, KIND_BVNOT))
+    put (2, ARGS_EQ, (KIND_DIST, KIND_EQ))
+    put (2, ARGS_BVEQ, (KIND_BVADD,  KIND_BVAND,  KIND_BVASHR, KIND_BVCOMP, 
+                        KIND_BVLSHR, KIND_BVMUL,  KIND_BVNAND, KIND_BVNOR,
+                        KIND_BVOR,   KIND_BVSDIV, KIND_BVSGE,  KIND_BVSGT,  
+                        KIND_BVSHL,  KIND_BVSLE,  KIND_BVSLT,  KIND_BVSMOD, 
+                        KIND_BVSREM, KIND_BVSUB,  KIND_BVUGE,  KIND_BVUGT,  
+                        KIND_BVUDIV, KIND_BVULE,  KIND_BVULT,  KIND_BVUREM, 
+                        KIND_BVXNOR, KIND_BVXOR))
+    put (2, ARGS_ARRAY, (KIND_SELECT, KIND_STORE))
+    put (2, ARGS_ITE, (KIND_ITE,))
+    # result sort
+    put (3, SORT_BOOL, (KIND_AND,   KIND_IMPL,  KIND_NOT,   KIND_OR,    KIND_XOR, 
+                        KIND_EQ,    KIND_DIST,  KIND_LE,    KIND_LT,    KIND_GE,
+                        KIND_GT,    KIND_ISI,   KIND_BVSGE, KIND_BVSGT, KIND_BVSLE,
+                        KIND_BVSLT, KIND_BVUGE, KIND_BVUGT, KIND_BVULE, KIND_BVULT))
+    put (3, SORT_INT, (KIND_ABS, KIND_DIV, KIND_MOD, KIND_TOI))
+    put (3, SORT_REAL, (KIND_RDIV, KIND_TOR))
+    put (3, SORT_CONC, (KIND_CONC,))
+    put (3, SORT_EXTR, (KIND_EXTR,))
+    put (3, SORT_REP, (KIND_REP,))
+    put (3, SORT_EXT, (KIND_SEXT, KIND_ZEXT))
+    put (3, SORT_BV1, (KIND_BVCOMP,))
+    put (3, SORT_NUM, (KIND_ADD, KIND_MUL, KIND_NEG, KIND_SUB, KIND_POW))
+    put (3, SORT_FIRST, (KIND_ROL,    KIND_ROR,    KIND_BVADD,
+                         KIND_BVAND,  KIND_BVASHR, KIND_BVLSHR, KIND_BVMUL,
+                         KIND_BVNAND, KIND_BVNEG,  KIND_BVNOR,  KIND_BVNOT,
+                         KIND_BVOR,   KIND_BVSDIV, KIND_BVSHL,  KIND_BVSMOD,
+                         KIND_BVSREM, KIND_BVSUB,  KIND_BVUDIV, KIND_BVUREM, 
+                         KIND_BVXNOR, KIND_BVXOR, KIND_STORE))
+    put (3, SORT_ITE, (KIND_ITE,))
+    put (3, SORT_SELECT, (KIND_SELECT,))
+    return [tuple (sigs[kind]) if kind in sigs else None for kind in g_kinds]
+
+
+# signatures of the predefined functions by kind code, None for other kinds:
+# (number of args or None, number of indices or None, ARGS_*, SORT_*)
+g_fun_signatures = _signatures ()
+
 
 
 class DDSMTParseCheckException (Exception):
@@ -185,13 +267,12 @@ class DDSMTParseException (SMTParseException):
 class SMTNode(object):
 
     __slots__ = ["id", "kind", "sort", "children"]
-    g_id = 0
+    g_ids = itertools.count(1)  # next() on it is atomic, so threads never share an id
     g_smtformula = None
 
     def __init__ (self, kind = "none", sort = None, children = []):
         assert (isinstance (children, list))
-        SMTNode.g_id += 1
-        self.id = SMTNode.g_id
+        self.id = next(SMTNode.g_ids)
         self.kind = kind
         self.sort = sort
         self.children = children
@@ -371,6 +452,8 @@ class SMTConstNode (SMTNode):
 
 class SMTBVConstNode (SMTConstNode):
 
+    __slots__ = []
+
     def __str__ (self):
         assert (self.kind != KIND_CONST)
         if self.is_subst():
@@ -628,6 +711,8 @@ class SMTForallExistsNode (SMTNode):
 
 class SMTLetNode (SMTNode):
 
+    __slots__ = []
+
     def __init__ (self, children):
         super(SMTLetNode, self).__init__(KIND_LET, children[-1].sort, children)
 
@@ -748,18 +833,17 @@ class SMTNamedAnnNode (SMTAnnNode):
                 self.dumped = True
 
 
-class SMTCmdNode:         
+class SMTCmdNode(object):
 
     __slots__ = ["id", "kind", "children"]
-    g_id = 0
+    g_ids = itertools.count(1)
     g_smtformula = None
 
     def __init__ (self, kind, children = []):
         global g_cmd_kinds
         assert (isinstance (children, list))
         assert (kind in g_cmd_kinds)
-        SMTCmdNode.g_id += 1
-        self.id = SMTCmdNode.g_id
+        self.id = next(SMTCmdNode.g_ids)
         self.kind = kind
         self.children = children
 
@@ -928,13 +1012,13 @@ class SMTScopeNode:
 
     __slots__ = ["id", "level", "prev", "kind", "scopes", "cmds", "funs",
                  "sorts", "declfun_cmds", "declfun_id"]
-    g_id = 0
+    g_ids = itertools.count(1)
     g_smtformula = None
 
-    def __init__ (self, level = 0, prev = None, kind = KIND_SCOPE):
+    def __init__ (self, level = 0, prev = None, kind = KIND_SCOPE, 
+                  lean = False):
         assert (kind in (KIND_SCOPE, KIND_FESCOPE, KIND_LSCOPE))
-        SMTScopeNode.g_id += 1
-        self.id = SMTScopeNode.g_id
+        self.id = next(SMTScopeNode.g_ids)
         self.level  = level
         self.prev   = prev
         self.kind   = kind
@@ -942,7 +1026,8 @@ class SMTScopeNode:
         self.cmds   = []
         self.funs   = {}
         self.sorts  = {}
-        self.declfun_cmds = {}  # used for substition with fresh variables
+        # used for substition with fresh variables, never in a lean formula
+        self.declfun_cmds = () if lean else {}
         self.declfun_id   = 0
 
     def __str__ (self):
@@ -1054,18 +1139,32 @@ class SMTCmdSubstList (SMTSubstList):
 
 class SMTFormula:
 
-    def __init__ (self):
+    def __init__ (self, lean = False, store = None):
+        # A lean formula is only read, as by the translation to Polya, and 
+        # keeps no substitutions: nothing in it is ever substituted. Neither
+        # does it keep its commands, which are only passed to the reader.
+        # If store is an astarray.ASTStore, each term node is put in it as
+        # soon as it is built, and a view of its row takes its place.
+        self.lean = lean
+        self.store = store
         self.logic = "none"
-        self.scopes = SMTScopeNode ()
+        self.scopes = SMTScopeNode (lean = lean)
         self.cur_scope = self.scopes
-        self.subst_scopes = SMTScopeSubstList ()
-        self.subst_cmds = SMTCmdSubstList ()
-        self.subst_nodes = SMTNodeSubstList ()
+        if lean:
+            self.subst_scopes = self.subst_cmds = self.subst_nodes = None
+        else:
+            self.subst_scopes = SMTScopeSubstList ()
+            self.subst_cmds = SMTCmdSubstList ()
+            self.subst_nodes = SMTNodeSubstList ()
         self.sorts_cache = {}
         self.consts_cache = {}
         self.funs_cache = {}   # fun name -> currently visible declaring scopes
         self.anns_cache = []   # named annotation nodes
         self.__add_predefined_sorts ()
+        # looked up for every function application, see check_funApp
+        self.sort_bool = self.sortNode ("Bool")
+        self.sort_int = self.sortNode ("Int")
+        self.sort_real = self.sortNode ("Real")
 
     def __add_predefined_sorts (self):
         self.add_sort ("Bool")
@@ -1103,6 +1202,7 @@ class SMTFormula:
         return self.scopes.is_substvar(node)
 
     def subst (self, node, substitution):
+        assert (not self.lean)
         if isinstance (node, SMTScopeNode):
             self.subst_scopes.subst(node, substitution)
         elif isinstance (node, SMTCmdNode):
@@ -1115,6 +1215,8 @@ class SMTFormula:
 
 
     def is_subst (self, node):
+        if self.lean:
+            return False
         if isinstance (node, SMTScopeNode):
             return self.subst_scopes.is_subst(node)
         elif isinstance (node, SMTCmdNode):
@@ -1140,10 +1242,12 @@ class SMTFormula:
         first_scope = None
         for i in range (nscopes):
             new_scope = SMTScopeNode (
-                    self.cur_scope.level + 1, self.cur_scope, kind)
+                    self.cur_scope.level + 1, self.cur_scope, kind, self.lean)
             if not first_scope:
                 first_scope = new_scope
-            self.cur_scope.scopes.append(new_scope)
+            # a lean formula is not printed, and need not keep closed scopes
+            if not self.lean:
+                self.cur_scope.scopes.append(new_scope)
             self.cur_scope = new_scope
         return first_scope  # scope associated with parent push cmd
 
@@ -1332,83 +1436,64 @@ class SMTFormula:
         return SMTAnFunNode (fun, sort)
 
     def check_funApp (self, fun, kind, children):
-        sortbool = self.sortNode("Bool")
-        sortint = self.sortNode("Int")
-        sortreal = self.sortNode("Real")
+        sortbool = self.sort_bool
+        sortint = self.sort_int
+        sortreal = self.sort_real
         # args declaration check
         for c in children:
             if not c.sort:
                 assert (c.kind == KIND_FUN)
                 raise DDSMTParseCheckException (
                         "function '{!s}' undeclared".format(c))
+        sig = g_fun_signatures[g_kind_codes[kind]]
+        nargs, nindices, args = sig[0:3] if sig else (None, None, None)
         # number of args check
-        if ((len(children) != 1 and 
-                 kind in (KIND_ABS, KIND_BVNEG, KIND_BVNOT, KIND_EXTR, KIND_ISI,
-                          KIND_NOT, KIND_NEG,   KIND_TOI,   KIND_TOR,  KIND_REP,
-                          KIND_ROL, KIND_ROR,   KIND_SEXT,  KIND_ZEXT)) or
-            (len(children) != 2 and
-                 kind in (KIND_BVADD,  KIND_BVAND,  KIND_BVASHR, KIND_BVCOMP, 
-                          KIND_BVLSHR, KIND_BVMUL,  KIND_BVNAND, KIND_BVNOR,
-                          KIND_BVOR,   KIND_BVSDIV, KIND_BVSGE,  KIND_BVSGT,
-                          KIND_BVSHL,  KIND_BVSLE,  KIND_BVSLT,  KIND_BVSMOD,
-                          KIND_BVSREM, KIND_BVSUB,  KIND_BVUGE,  KIND_BVUGT,
-                          KIND_BVUDIV, KIND_BVULE,  KIND_BVULT,  KIND_BVUREM,
-                          KIND_BVXNOR, KIND_BVXOR,  KIND_CONC,   KIND_MOD,
-                          KIND_SELECT)) or
-            (len(children) != 3 and 
-                kind in (KIND_ITE, KIND_STORE))):
+        if nargs and len(children) != nargs:
             raise DDSMTParseCheckException (
                     "invalid number of arguments to '{!s}': {}" \
                     "".format(fun, len(children)))
         # number of indices check
-        if self.is_bv_logic:
-            if kind == KIND_EXTR and len(fun.indices) != 2:
-                raise DDSMTParseCheckException (
-                    "'{!s}' expects exactly two indices, {} given" \
-                    "".format(fun.name, len(fun.indices)))
-            elif kind in (KIND_REP, KIND_ROL, KIND_ROR, KIND_SEXT, KIND_ZEXT) \
-                 and len(fun.indices) != 1:
-                raise DDSMTParseCheckException (
-                    "'{!s}' expects exactly one index, {} given" \
-                    "".format(fun.name, len(fun.indices)))
+        if self.is_bv_logic and nindices and len(fun.indices) != nindices:
+            raise DDSMTParseCheckException (
+                "'{!s}' expects exactly {}, {} given".format(
+                    fun.name, "two indices" if nindices == 2 else "one index",
+                    len(fun.indices)))
         # args sort Bool check
-        if kind in (KIND_AND, KIND_IMPL, KIND_NOT, KIND_OR, KIND_XOR):
+        if args == ARGS_BOOL:
             for c in children:
                 if not c.sort == sortbool:
                     raise DDSMTParseCheckException (
                         "'{!s}' expects sort 'Bool' as argument(s), " \
                         "found '{}'".format(fun, c.sort))
         # args Int check
-        elif kind in (KIND_ABS, KIND_DIV, KIND_MOD, KIND_TOR):
+        elif args == ARGS_INT:
             for c in children:
                 if not c.sort == sortint:
                     raise DDSMTParseCheckException (
                         "'{!s}' expects sort 'Int' as argument(s), " \
                         "found '{}'".format(fun, c.sort))
         # args Real check
-        elif kind in (KIND_RDIV, KIND_ISI, KIND_TOI):
+        elif args == ARGS_REAL:
             for c in children:
                 if c.sort not in (sortint, sortreal):
                     raise DDSMTParseCheckException (
                         "'{!s}' expects sort 'Real' as argument(s)" \
                         "".format(fun))
         # args Int or Real check
-        elif kind in (KIND_ADD, KIND_GE, KIND_GT, KIND_LE, KIND_LT, KIND_MUL, 
-                      KIND_NEG, KIND_SUB, KIND_POW):
+        elif args == ARGS_NUM:
             c0 = children[0]
             if c0.sort not in (sortint, sortreal):
                 raise DDSMTParseCheckException (
                     "'{!s}' expects sort 'Int' or 'Real' as argument(s)" \
                     "".format(fun))
         # args BV sort check
-        elif kind in (KIND_CONC, KIND_EXTR, KIND_REP,   KIND_ROL,  KIND_ROR, 
-                      KIND_SEXT, KIND_ZEXT, KIND_BVNEG, KIND_BVNOT):
+        elif args == ARGS_BV:
             for c in children:
                 if not c.sort.is_bv_sort:
                     raise DDSMTParseCheckException (
                         "'{!s}' expects BV sort as argument(s)".format(fun))
         # args equal sort check
-        elif kind in (KIND_DIST, KIND_EQ):
+        elif args == ARGS_EQ:
             c0 = children[0]
             for c in children[1:]:
                 if c.sort != c0.sort \
@@ -1418,13 +1503,7 @@ class SMTFormula:
                         "'{!s}' with mismatching sorts: '{!s}' '{!s}'" \
                         "".format(fun, c0.sort, c.sort)) 
         # args equal bw check
-        elif kind in (KIND_BVADD,  KIND_BVAND,  KIND_BVASHR, KIND_BVCOMP, 
-                      KIND_BVLSHR, KIND_BVMUL,  KIND_BVNAND, KIND_BVNOR,
-                      KIND_BVOR,   KIND_BVSDIV, KIND_BVSGE,  KIND_BVSGT,  
-                      KIND_BVSHL,  KIND_BVSLE,  KIND_BVSLT,  KIND_BVSMOD, 
-                      KIND_BVSREM, KIND_BVSUB,  KIND_BVUGE,  KIND_BVUGT,  
-                      KIND_BVUDIV, KIND_BVULE,  KIND_BVULT,  KIND_BVUREM, 
-                      KIND_BVXNOR, KIND_BVXOR):
+        elif args == ARGS_BVEQ:
             c0 = children[0]
             if not c0.sort.is_bv_sort:
                 raise DDSMTParseCheckException (
@@ -1435,12 +1514,12 @@ class SMTFormula:
                         "'{!s}' with mismatching sorts: '{!s}' '{!s}'" \
                         "".format(fun, c0.sort, c.sort)) 
         # first arg Array check
-        elif kind in (KIND_SELECT, KIND_STORE):
+        elif args == ARGS_ARRAY:
             if not children[0].sort.is_arr_sort():
                 raise DDSMTParseCheckException (
                     "'{!s}' expects Array sort as first argument".format(fun))
         # ITE arg check
-        elif kind == KIND_ITE:
+        elif args == ARGS_ITE:
             if not children[0].sort == sortbool:
                 raise DDSMTParseCheckException (
                     "'{!s}' expects sort 'Bool' as first argument".format(fun))
@@ -1473,53 +1552,44 @@ class SMTFormula:
 
     def funApp2sort (self, fun, kind, children):
         self.check_funApp(fun, kind, children)
-        # sort Bool
-        if kind in (KIND_AND,   KIND_IMPL,  KIND_NOT,   KIND_OR,    KIND_XOR, 
-                    KIND_EQ,    KIND_DIST,  KIND_LE,    KIND_LT,    KIND_GE,
-                    KIND_GT,    KIND_ISI,   KIND_BVSGE, KIND_BVSGT, KIND_BVSLE,
-                    KIND_BVSLT, KIND_BVUGE, KIND_BVUGT, KIND_BVULE, KIND_BVULT):
-            return self.sortNode("Bool")
-        # sort Int
-        elif kind in (KIND_ABS, KIND_DIV, KIND_MOD, KIND_TOI):
-            return self.sortNode("Int")
-        # sort Real
-        elif kind in (KIND_RDIV, KIND_TOR):
-            return self.sortNode("Real")
+        sig = g_fun_signatures[g_kind_codes[kind]]
+        result = sig[3] if sig else None
+        if result == None:
+            return fun.sort
+        elif result == SORT_BOOL:
+            return self.sort_bool
+        elif result == SORT_INT:
+            return self.sort_int
+        elif result == SORT_REAL:
+            return self.sort_real
+        # sort defined by children
+        elif result == SORT_NUM:
+            for c in children:
+                if c.sort == self.sort_real:
+                    return self.sort_real
+            return children[0].sort
+        elif result == SORT_FIRST:
+            return children[0].sort
         # sort BV sort != children sort
-        elif kind == KIND_CONC:
+        elif result == SORT_CONC:
             return self.bvSortNode(
                        children[0].sort.bw + children[1].sort.bw)
-        elif kind == KIND_EXTR:
+        elif result == SORT_EXTR:
             return self.bvSortNode(fun.indices[0] - fun.indices[1] + 1)
-        elif kind == KIND_REP:
+        elif result == SORT_REP:
             return self.bvSortNode(fun.indices[0] * children[0].sort.bw)
-        elif kind in (KIND_SEXT, KIND_ZEXT):
+        elif result == SORT_EXT:
             return self.bvSortNode(fun.indices[0] + children[0].sort.bw)
-        elif kind == KIND_BVCOMP:
+        elif result == SORT_BV1:
             return self.bvSortNode(1)
-        # sort defined by children
-        elif kind in (KIND_ADD, KIND_MUL, KIND_NEG, KIND_SUB, KIND_POW):
-            if True in [c.sort == self.sortNode("Real") for c in children]:
-                return self.sortNode("Real")
-            return children[0].sort
-            
-        elif kind in (KIND_NEG,    KIND_ROL,    KIND_ROR,    KIND_BVADD,
-                      KIND_BVAND,  KIND_BVASHR, KIND_BVLSHR, KIND_BVMUL,
-                      KIND_BVNAND, KIND_BVNEG,  KIND_BVNOR,  KIND_BVNOT,
-                      KIND_BVOR,   KIND_BVSDIV, KIND_BVSHL,  KIND_BVSMOD,
-                      KIND_BVSREM, KIND_BVSUB,  KIND_BVUDIV, KIND_BVUREM, 
-                      KIND_BVXNOR, KIND_BVXOR):
-            return children[0].sort
         # special cases
-        elif kind == KIND_ITE: 
-            if True in [c.sort == self.sortNode("Real") for c in children[1:]]:
-                return self.sortNode("Real")
+        elif result == SORT_ITE: 
+            for c in children[1:]:
+                if c.sort == self.sort_real:
+                    return self.sort_real
             return children[1].sort
-        elif kind == KIND_SELECT:
-            return children[0].sort.elem_sort
-        elif kind == KIND_STORE:
-            return children[0].sort
-        return fun.sort
+        assert (result == SORT_SELECT)
+        return children[0].sort.elem_sort
 
     def funAppNode (self, fun, children):
         global g_fun_kinds
@@ -1531,7 +1601,8 @@ class SMTFormula:
             else:
                 kind = name
         sort = self.funApp2sort(fun, kind, children)
-        return SMTFunAppNode (fun, kind, sort, children)
+        node = SMTFunAppNode (fun, kind, sort, children)
+        return node if self.store is None else self.store.add(node)
 
     def letFeNode (self, kind, children, svars = None):
         assert (kind in (KIND_LET, KIND_FORALL, KIND_EXISTS))
@@ -1549,8 +1620,9 @@ class SMTFormula:
             assert (self.cur_scope.kind == KIND_FESCOPE)
             ch = children
         self.close_scope()
-        return SMTLetNode (ch) if kind == KIND_LET \
+        node = SMTLetNode (ch) if kind == KIND_LET \
                                else SMTForallExistsNode (svars, kind, ch)
+        return node if self.store is None else self.store.add(node)
     
     def annNode (self, attributes, sort, children):
         for attrib in attributes:
@@ -1573,27 +1645,34 @@ class SMTFormula:
                     self.funs_cache[name] = [self.cur_scope]
                 self.anns_cache.append(self.cur_scope.funs[name])
                 return self.cur_scope.funs[name]
-        return SMTAnnNode (attributes, sort, children)
+        node = SMTAnnNode (attributes, sort, children)
+        return node if self.store is None else self.store.add(node)
 
 
     def cmdNode (self, kind, children = []):
         assert (self.cur_scope != None)
         cmd = None
+        # a lean formula leaves the commands to its reader, so that each can
+        # be freed once it has been read
+        cmds = self.cur_scope.cmds if not self.lean else None
         if kind == KIND_PUSH:
             assert (len(children) == 1)
             assert (isinstance (children[0], SMTConstNode))
             cmd = SMTPushCmdNode (children[0].value)
-            self.cur_scope.cmds.append(cmd)
+            if cmds is not None:
+                cmds.append(cmd)
             cmd.scope = self.open_scope(cmd.nscopes)
         elif kind == KIND_POP:
             assert (len(children) == 1)
             assert (isinstance (children[0], SMTConstNode))
             cmd = SMTPopCmdNode (children[0].value)
-            self.cur_scope.cmds.append(cmd)
+            if cmds is not None:
+                cmds.append(cmd)
             self.close_scope (cmd.nscopes)
         else:
             cmd = SMTCmdNode (kind, children)
-            self.cur_scope.cmds.append(cmd)
+            if cmds is not None:
+                cmds.append(cmd)
         return cmd
 
     def add_fresh_declfunCmdNode (self, sort):
@@ -1622,11 +1701,32 @@ class SMTFormula:
 
 
 
+def pin_formula (smtformula):
+    """
+    Makes smtformula the one whose substitutions the nodes look up.
+    """
+    SMTNode.g_smtformula = smtformula
+    SMTCmdNode.g_smtformula = smtformula
+    SMTScopeNode.g_smtformula = smtformula
+
+
+def unpin_formula (smtformula):
+    """
+    Undoes pin_formula(smtformula), unless another formula was pinned since.
+    Without substitutions, as outside the delta debugger, nodes print the same
+    with no formula pinned.
+    """
+    if SMTNode.g_smtformula is smtformula:
+        pin_formula(None)
+
+
 class DDSMTParser (SMTParser):
     
-    def __init__ (self):
+    def __init__ (self, lean = False, store = None):
+        # lean: builds a lean SMTFormula, for input that is only translated;
+        # store: an astarray.ASTStore to keep its terms in, see SMTFormula
         super(DDSMTParser, self).__init__()
-        self.smtformula = SMTFormula()
+        self.smtformula = SMTFormula(lean, store)
         self.__set_parse_actions()
 
     def parse (self, infile):
@@ -1634,11 +1734,22 @@ class DDSMTParser (SMTParser):
             super(DDSMTParser, self).parse(infile)
         except SMTParseException as e:
             raise DDSMTParseException (e.msg, e.parser)
-        SMTNode.g_smtformula = self.smtformula
-        SMTCmdNode.g_smtformula = self.smtformula
-        SMTScopeNode.g_smtformula = self.smtformula
+        pin_formula(self.smtformula)
         return self.smtformula
 
+    def iter_commands (self, infile, text = None):
+        # unlike parse, unpins the formula when done, so that it can be freed;
+        # a lean formula has no substitutions to look up, and is not pinned
+        if not self.smtformula.lean:
+            pin_formula(self.smtformula)
+        try:
+            for cmd in super(DDSMTParser, self).iter_commands(infile, text):
+                yield cmd
+        except SMTParseException as e:
+            raise DDSMTParseException (e.msg, e.parser)
+        finally:
+            unpin_formula(self.smtformula)
+
     def __set_parse_actions (self):
         sf = self.smtformula
         try:
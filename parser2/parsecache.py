@@ -0,0 +1,152 @@
+"""
+An on-disk cache of parsed SMT-LIB v2 files.
+
+An entry holds the commands of a file in order, together with the SMTFormula they belong to,
+pickled and compressed. It is keyed by the hash of the file's contents and of the parser's own
+source, so that editing either one makes old entries unreachable. Hits refresh an entry's
+mtime, and when the directory grows past its size cap the least recently used entries are
+removed.
+"""
+
+import cPickle
+import hashlib
+import itertools
+import os
+import tempfile
+import zlib
+
+from parser2 import astarray, ddsmtparser, smtparser
+from parser2.ddsmtparser import DDSMTParser, SMTNode, SMTCmdNode, SMTScopeNode
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024  # in bytes
+SUFFIX = '.ast'
+
+
+def _parser_version():
+    h = hashlib.sha1()
+    # the commands of compact entries are stored with their astarray.ASTStore
+    for module in (smtparser, ddsmtparser, astarray):
+        with open(os.path.splitext(module.__file__)[0] + '.py', 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+PARSER_VERSION = _parser_version()
+
+
+class ParseCache(object):
+    """
+    A cache directory, holding at most about max_size bytes of parsed files.
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, filename, text=None, compact=False):
+        h = hashlib.sha1(PARSER_VERSION)
+        # the commands of compact runs hold views of an astarray.ASTStore, and are kept apart
+        if compact:
+            h.update('compact\0')
+        if text is None:
+            with open(filename, 'rb') as f:
+                text = f.read()
+        h.update(text)
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def iter_commands(self, filename, stats=None, text=None, compact=False):
+        """
+        Yields the commands of filename, or of text if it is given, like
+        DDSMTParser.iter_commands, from the cache if they are there. Otherwise the input is
+        parsed, and stored once all of it has been read. stats is passed on to the parser.
+        The formulas are lean, see ddsmtparser.SMTFormula, as they are only translated. If
+        compact is true, their terms are kept in an astarray.ASTStore, which is stored with
+        them in an entry of its own.
+        """
+        key = self.key(filename, text, compact)
+        cmds = self.load(key)
+        if cmds is not None:
+            for cmd in cmds:
+                yield cmd
+            return
+        parser = DDSMTParser(lean=True, store=astarray.ASTStore() if compact else None)
+        parser.stats = stats
+        cmds = []
+        for cmd in parser.iter_commands(filename, text):
+            cmds.append(cmd)
+            yield cmd
+        self.store(key, parser.smtformula, cmds)
+
+    def load(self, key):
+        """
+        Returns the commands stored under key, or None. A damaged entry is removed.
+        """
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except IOError:
+            return None
+        try:
+            ids, smtformula, cmds = cPickle.loads(zlib.decompress(data))
+        except Exception:
+            self._remove(path)
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        # new nodes must not reuse the ids of the loaded ones
+        for cls, i in zip((SMTNode, SMTCmdNode, SMTScopeNode), ids):
+            cls.g_ids = itertools.count(max(next(cls.g_ids), i))
+        return cmds
+
+    def store(self, key, smtformula, cmds):
+        """
+        Stores cmds and their smtformula under key, then evicts entries until the cache fits in
+        max_size. Formulas that are too deeply nested to pickle are not stored.
+        """
+        # the next free id of each class
+        ids = (next(SMTNode.g_ids), next(SMTCmdNode.g_ids), next(SMTScopeNode.g_ids))
+        try:
+            data = zlib.compress(cPickle.dumps((ids, smtformula, cmds), 2))
+        except RuntimeError:
+            return
+        # written under a temporary name first, so that readers never see half an entry
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(tmp, self.path(key))
+        except (IOError, OSError):
+            self._remove(tmp)
+            return
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            self._remove(path)
+            total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
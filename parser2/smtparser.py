@@ -18,8 +18,274 @@
 # along with ddSMT.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import bisect
+import itertools
 import sys
 import re
+from array import array
+
+
+CHUNK_SIZE = 1 << 16
+
+SOURCE = "set-info :source"
+SOURCE_RE = re.compile(r'set-info :source\s*(\|[^|]*(\|)?)?')
+SPACE = " \t\n\r\x0b\x0c"
+# what tokenize drops in front of a token: white space, and comments ending
+# in a newline
+SKIP_RE = re.compile(r'(?:\s|;[^\n]*\n)*')
+SKIP_FIRST = SPACE + ';'
+QUOTED = ('|', '"')     # the first characters of quoted symbols and strings
+
+
+def _read_chunks (infile):
+    while True:
+        chunk = infile.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _mask (text):
+    text = re.sub(r'set-info :source\s*\|.*?\|',
+                  lambda x: x.group(0).replace(';', ','), text,
+                  flags=re.DOTALL)
+    return re.sub(r'".*?"', lambda x: x.group(0).replace(';', ','), text,
+                  flags=re.DOTALL)
+
+
+def _mask_cut (buf):
+    # The end of the longest prefix of buf that no set-info :source pipe or
+    # string runs out of, given that more text may follow.
+    sources = []
+    p = len(buf)
+    pos = 0
+    while True:
+        x = buf.find(SOURCE, pos)
+        if x == -1:
+            break
+        m = SOURCE_RE.match(buf, x)
+        if m.group(2):
+            sources.append((x, m.end()))
+            pos = m.end()
+        elif m.end() == len(buf):
+            p = x
+            break
+        else:
+            pos = x + 1
+    if p == len(buf):
+        for k in range(max(pos, len(buf) - len(SOURCE) + 1), len(buf)):
+            if SOURCE.startswith(buf[k:]):
+                p = k
+                break
+    while True:
+        q = p
+        if buf.count('"', 0, q) % 2:
+            q = buf.rfind('"', 0, q)
+        for (x, e) in sources:
+            if x < q < e:
+                q = x
+        if q == p:
+            return p
+        p = q
+
+
+def _mask_comment_chars (chunks):
+    # Replaces ';' by ',' in set-info :source pipes and in strings, so that
+    # they do not start comments.
+    buf = ""
+    for chunk in chunks:
+        buf += chunk
+        p = _mask_cut(buf)
+        if p:
+            yield _mask(buf[:p])
+            buf = buf[p:]
+    if buf:
+        yield _mask(buf)
+
+
+def _strip_comments (pieces):
+    buf = ""
+    for piece in pieces:
+        buf += piece
+        # a ';' after the last newline may start a comment that goes on
+        p = buf.find(';', buf.rfind('\n') + 1)
+        if p == -1:
+            p = len(buf)
+        if p:
+            yield re.sub(r';[^\n]*\n', ' ', buf[:p])
+            buf = buf[p:]
+    if buf:
+        yield re.sub(r';[^\n]*\n', ' ', buf)
+
+
+def _space_lpars (pieces):
+    buf = ""
+    for piece in pieces:
+        buf += piece
+        # whether '(' starts "(_ " may depend on the next two characters
+        p = len(buf)
+        while p and '(' in buf[max(0, p - 2):p]:
+            p -= 1
+        if p:
+            yield re.sub(r'\((?!_ )', ' ( ', buf[:p])
+            buf = buf[p:]
+    if buf:
+        yield re.sub(r'\((?!_ )', ' ( ', buf)
+
+
+def _split (text):
+    return re.sub(r'(?<!\\)\)', ' ) ', text).split()
+
+
+def _after_space (buf):
+    return max(buf.rfind(c) for c in SPACE) + 1
+
+
+def _quoted_end (buf, j):
+    # The index of the quote that closes the string opened at j, or -1.
+    # Like the SMT-LIB v1 tokenizer this is based on, a quote right after a
+    # backslash does not close the string.
+    k = j
+    while True:
+        q = k
+        k = buf.find(SMTParser.QUOTE, q + 1)
+        if k == -1 or k == q + 1 or buf[k - 1] != SMTParser.BSLASH:
+            return k
+
+
+def tokenize (chunks):
+    """
+    Splits the SMT-LIB v2 text given as an iterable of chunks into tokens,
+    and yields them a list at a time, reading the chunks only as far as
+    needed.
+    """
+    start = True    # at the start of the text in front of a symbol or string
+    plain = False   # past a '|' or '"' with nothing in front of it
+    buf = ""
+    pieces = _space_lpars(_strip_comments(_mask_comment_chars(chunks)))
+    for piece in itertools.chain(pieces, [None]):
+        eof = piece is None
+        if not eof:
+            buf += piece
+        tokens = []
+        while buf:
+            if plain:
+                p = len(buf) if eof else _after_space(buf)
+                tokens.extend(_split(buf[:p]))
+                buf = buf[p:]
+                break
+            if start:
+                if buf[0] in (SMTParser.PIPE, SMTParser.QUOTE):
+                    # everything from here on is split like other text
+                    plain = True
+                    buf = buf[1:]
+                    continue
+                start = False
+            pidx = buf.find(SMTParser.PIPE)
+            qidx = buf.find(SMTParser.QUOTE)
+            j = pidx if qidx == -1 or (pidx >= 0 and pidx < qidx) else qidx
+            if j == -1:
+                p = len(buf) if eof else _after_space(buf)
+                tokens.extend(_split(buf[:p]))
+                buf = buf[p:]
+                break
+            if buf[j] == SMTParser.PIPE:
+                k = buf.find(SMTParser.PIPE, j + 1)
+            else:
+                k = _quoted_end(buf, j)
+            if k == -1 and not eof:
+                break
+            tokens.extend(_split(buf[:j]))
+            if k != -1:
+                tokens.append(buf[j:k + 1])
+                buf = buf[k + 1:]
+            elif buf[j] == SMTParser.PIPE:
+                tokens.append(buf[j:])
+                buf = ""
+            else:
+                # an unclosed string is closed at the end of the input
+                rest = buf[buf.rfind(SMTParser.QUOTE) + 1:]
+                tokens.append(buf[j:] + SMTParser.QUOTE
+                        + (SMTParser.QUOTE if rest.endswith(SMTParser.BSLASH)
+                                           else ""))
+                buf = ""
+            start = True
+        if eof and not start and not plain:
+            # the text after the last symbol or string ends in an empty token
+            tokens.append("")
+        if tokens:
+            yield tokens
+
+
+class TokenIndex (object):
+    """
+    Where the tokens of a text start, as offsets into the text, and where its
+    lines start, recorded while the text is tokenized. The position of a
+    token is then a binary search in the line starts, without reading the
+    text again, so that it is also known for input read from stdin.
+    Only the text after the last located token is kept.
+    """
+
+    __slots__ = ["line_starts", "buf", "buf_start", "end"]
+
+    def __init__ (self):
+        self.line_starts = array('l', [0])
+        self.buf = ""       # the text from offset buf_start on
+        self.buf_start = 0
+        self.end = 0        # the length of the text read so far
+
+    def read (self, chunks):
+        # passes the chunks of the text on, noting where its lines start
+        for chunk in chunks:
+            i = chunk.find('\n')
+            while i != -1:
+                self.line_starts.append(self.end + i + 1)
+                i = chunk.find('\n', i + 1)
+            self.end += len(chunk)
+            self.buf += chunk
+            yield chunk
+
+    def locate (self, tokens):
+        """
+        Returns the offsets of tokens, the next ones tokenize yields from the
+        text read, as an array.
+        """
+        offsets = array('l')
+        append = offsets.append
+        match = SKIP_RE.match
+        buf = self.buf
+        base = self.buf_start
+        pos = 0
+        for token in tokens:
+            if buf[pos:pos + 1] in SKIP_FIRST:
+                pos = match(buf, pos).end()
+            append(base + pos)
+            c = token[:1]
+            if c not in QUOTED:
+                pos += len(token)
+                continue
+            elif c == SMTParser.PIPE:
+                k = buf.find(SMTParser.PIPE, pos + 1)
+            else:
+                k = _quoted_end(buf, pos)
+            # tokenize spaces the '(' in quoted symbols and strings too, and
+            # closes unclosed ones, so these are measured in the text
+            pos = len(buf) if k == -1 else k + 1
+        self.buf = buf[pos:]
+        self.buf_start += pos
+        return offsets
+
+    def position (self, offset):
+        """
+        Returns the line and column of offset, both counting from 1.
+        """
+        line = bisect.bisect_right(self.line_starts, offset)
+        return (line, offset - self.line_starts[line - 1] + 1)
+
+
+def _located (index, token_lists):
+    for tokens in token_lists:
+        yield (tokens, index.locate(tokens))
 
 
 class SMTParseException (Exception):
@@ -31,9 +297,6 @@ class SMTParseException (Exception):
         (self.line, self.col) = parser.get_pos()
 
     def __str__ (self):
-        if self.filename == 'STDIN':
-            return "[smtparser] {} (location not available using stdin): {}".format(
-                self.filename, self.msg)
         return "[smtparser] {}:{}:{}: {}".format(
                 self.filename, self.line, self.col, self.msg)
 
@@ -146,9 +409,14 @@ class SMTParser(object):
 
     def __init__ (self):
         self.filename = ""
-        self.tokens = []
+        self.tokens = []        # the tokens from index self.base on
+        self.offsets = array('l')   # where they start in the input
+        self.index = TokenIndex()
+        self.token_lists = iter([])
+        self.base = 0
         self.la = ""
         self.pos = 0
+        self.stats = None       # if set, the time spent tokenizing is charged to it
 
         self.spec_chars = "+-/*=%?!.$_~&^<>@"
 
@@ -180,118 +448,80 @@ class SMTParser(object):
         self.script          = SMTParseElement()
 
     def parse (self, filename):
+        tokens = SMTParseResult()
+        for cmd in self.iter_commands(filename):
+            tokens.append(cmd)
+        return self.script.parse_action(tokens)
+
+    def iter_commands (self, filename, text = None):
+        """
+        Yields the commands of filename one at a time, each as soon as it
+        is parsed, reading only as much input as the next command needs.
+        If text is given, it is parsed instead, and filename only names it
+        in error messages.
+        """
         self.filename = filename
-        self.tokens = self.__tokenize()
-        self.__scan()
-        return self.script.parse_action(self.__script())
+        if text is not None:
+            infile = None
+        elif (self.filename == "STDIN"):
+            infile = sys.stdin
+        else:
+            infile = open(self.filename, 'r')
+        try:
+            self.tokens = []
+            self.offsets = array('l')
+            self.index = TokenIndex()
+            self.token_lists = _located(self.index, tokenize(self.index.read(
+                    [text] if infile is None else _read_chunks(infile))))
+            if self.stats:
+                self.token_lists = self.stats.timed('tokenize', self.token_lists)
+            self.base = 0
+            self.pos = 0
+            self.__scan()
+            while self.__fill(self.pos):
+                yield self.command.parse_action(self.__command())
+                self.__release()
+        finally:
+            if infile not in (None, sys.stdin):
+                infile.close()
                 
     def get_pos (self):
-        if self.filename == 'STDIN':
-            return (0, 0)
-        line = 1
-        col = 0
-        with open (self.filename, 'r') as infile:
-            instring = infile.read()
-            (idx, line, col) = self.__skip_space(instring, 0, 1, 0)
-            (idx, line, col) = self.__skip_comment(instring, idx, line, col)
-            for token in self.tokens[:self.pos - 1]:
-                for i in range(0, len(token)):
-                    (idx, line, col) = \
-                            self.__skip_space(instring, idx, line, col)
-                    if token[i].isspace():
-                        continue
-                    assert (token[i] == instring[idx] \
-                            or (token[i] == SMTParser.COMMA and
-                                instring[idx] == SMTParser.COMMENT))
-                    col += 1
-                    idx += 1
-                (idx, line, col) = self.__skip_space(instring, idx, line, col)
-                (idx, line, col) = self.__skip_comment(instring, idx, line, col)
-                (idx, line, col) = self.__skip_space(instring, idx, line, col)
-        return (line, col + 1)       
-
-    def __skip_space (self, instring, idx, line, col):
-        while idx < len(instring) and instring[idx].isspace():
-            if instring[idx] == '\n':
-                line += 1
-                col = 0
-            else:
-                col += 1
-            idx += 1
-        return (idx, line, col)
-
-    def __skip_comment (self, instring, idx, line, col):
-        while idx < len(instring) and instring[idx] == SMTParser.COMMENT:
-            while idx < len(instring) and instring[idx] != '\n':
-                 idx += 1
-            (idx, line, col) = self.__skip_space(instring, idx, line, col)
-        return (idx, line, col)
-    
+        # the position of the lookahead, or of the end of the input after
+        # the last token
+        i = self.pos - 1 - self.base
+        offset = self.offsets[i] if 0 <= i < len(self.offsets) \
+                                 else self.index.end
+        return self.index.position(offset)
+
+    def __fill (self, pos):
+        # reads tokens until the one at pos is there, False if there is none
+        while pos - self.base >= len(self.tokens):
+            try:
+                (tokens, offsets) = next(self.token_lists)
+            except StopIteration:
+                return False
+            self.tokens.extend(tokens)
+            self.offsets.extend(offsets)
+        return True
+
+    def __release (self):
+        # drops the tokens before the lookahead, which are never revisited
+        # once a command has been parsed
+        del self.tokens[:self.pos - 1 - self.base]
+        del self.offsets[:self.pos - 1 - self.base]
+        self.base = self.pos - 1
+
     def __scan (self):
-        try:
-            self.la = self.tokens[self.pos]
-        except IndexError:
+        if self.__fill(self.pos):
+            self.la = self.tokens[self.pos - self.base]
+        else:
             self.la = ""
         self.pos += 1
 
     def __scan_back (self, steps):
-        assert (self.pos - steps > 0)
+        assert (self.pos - steps > self.base)
         self.pos -= steps
-        self.la = self.tokens[self.pos - 1]
-
-    def __tokenize (self):
-        #with open (self.filename, 'r') as infile:
-        if (self.filename == "STDIN"):
-            infile = sys.stdin
-        else:
-            infile = open(self.filename, 'r')
-        tokens = []
-        # Note: separate re.subs are way faster than combined subs that
-        #       require more testing, e.g.
-        #           re.sub(r'(?<!\\)(?P<m>["\)])',
-        #                  " {} ".format(r'\g<m>'), instring)
-        instring = re.sub(
-                r'set-info :source\s*\|.*?\|',
-                lambda x: re.sub(
-                    SMTParser.COMMENT, SMTParser.COMMA, x.group(0)),
-                infile.read(),
-                flags=re.DOTALL)
-        instring = re.sub (
-                r'".*?"',
-                lambda x: re.sub(
-                    SMTParser.COMMENT, SMTParser.COMMA, x.group(0)),
-                instring,
-                flags=re.DOTALL)
-        instring = re.sub(r';[^\n]*\n', ' ' , instring)
-        instring = re.sub(r'\((?!_ )', ' ( ', instring)
-
-        pidx = instring.find(SMTParser.PIPE)
-        qidx = instring.find(SMTParser.QUOTE)
-        c = SMTParser.PIPE if qidx == -1 or (pidx >= 0 and pidx < qidx) \
-                           else SMTParser.QUOTE
-        instring = instring.partition(c)
-        while instring[0]:
-            tokens.extend(
-                    re.sub(r'(?<!\\)\)', ' ) ', instring[0]).split())
-            part = instring[2].partition(c)
-            if c == SMTParser.PIPE:
-                tokens.append("{}{}{}".format(
-                    instring[1], part[0], part[1]))
-            else:
-                strings = []
-                strings.append(part[0])
-                while part[0] and part[0][-1] == '\\':
-                    part = part[2].partition(c)
-                    strings.append(part[0])
-                tokens.append("\"{}\"".format(
-                    "\"".join([s for s in strings])))
-            pidx = part[2].find(SMTParser.PIPE)
-            qidx = part[2].find(SMTParser.QUOTE)
-            c = SMTParser.PIPE if qidx == -1 or (pidx >= 0 and pidx < qidx)\
-                               else SMTParser.QUOTE
-            instring = part[2].partition(c)
-        tokens.extend(re.sub(r'(?<!\\)\)', ' ) ', instring[2]).split())
-        return tokens
+        self.la = self.tokens[self.pos - 1 - self.base]
 
     def __check_lpar (self, msg = "'(' expected"):
         if self.la != SMTParser.LPAR:
@@ -824,9 +1054,3 @@ class SMTParser(object):
                     "unknown command '{}'".format(self.la), self)
         self.__check_rpar()
         return tokens
-
-    def __script (self):
-        tokens = SMTParseResult()
-        while self.pos < len(self.tokens):
-            tokens.append(self.command.parse_action(self.__command()))
-        return tokens
@@ -0,0 +1,79 @@
+"""
+A thin client for polya_server.py. It takes the same arguments as single_translate.py and prints
+the same output, but leaves the solving to a running server, so that each call only pays for
+starting this script. If no server is listening, the problem is solved in-process instead.
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import tempfile
+
+default_socket = os.environ.get('POLYA_SOCKET', '/tmp/polya-{0}.sock'.format(os.getuid()))
+
+
+def request(req, path=default_socket):
+    """
+    Sends the request dictionary req to the server listening on path, and returns its answer.
+    Raises socket.error if no server is listening.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        sock.sendall(json.dumps(req) + '\n')
+        return sock.makefile('r').readline()
+    finally:
+        sock.close()
+
+
+def solve_locally(req):
+    import single_translate
+    file = req['file']
+    if 'input' in req:
+        with tempfile.NamedTemporaryFile(suffix='.smt2', delete=False) as f:
+            f.write(req['input'])
+        file = f.name
+    try:
+        single_translate.batch_test(file, (req['timeout'] or single_translate.timeout),
+                                    req['force_fm'], req['force_smt'], req['z3out'],
+                                    workers=req['workers'], portfolio=req['portfolio'],
+                                    solver_type=('auto' if req['auto'] else None),
+                                    memory=req['memory'])
+    finally:
+        if 'input' in req:
+            os.remove(file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Process smt file using a Polya server.")
+    parser.add_argument('file', metavar='file', type=str, help="path to smt file")
+    parser.add_argument('-t', type=int,  help="timeout (in sec)")
+    parser.add_argument('-f', action="store_true", help="force FM")
+    parser.add_argument('-s', action="store_true",  help="force SMT output from simplify")
+    parser.add_argument('-version', action="store_true", help="version")
+    parser.add_argument('-z', action="store_true", help="z3-style output")
+    parser.add_argument('-j', type=int, default=1,
+                        help="number of processes to test disjuncts with")
+    parser.add_argument('-p', action="store_true",
+                        help="portfolio: race the FM and polytope solvers")
+    parser.add_argument('-a', action="store_true",
+                        help="choose the FM or polytope solver from features of the problem")
+    parser.add_argument('-m', type=int, help="memory limit (in MB)")
+    parser.add_argument('--socket', default=default_socket,
+                        help="server socket (default: {0})".format(default_socket))
+    args = parser.parse_args()
+    if args.version:
+        print '0.1'
+    else:
+        req = {'file': args.file, 'timeout': args.t, 'force_fm': args.f, 'force_smt': args.s,
+               'z3out': args.z, 'workers': args.j, 'portfolio': args.p,
+               'auto': args.a, 'memory': args.m}
+        if args.file == 'STDIN':
+            req['input'] = sys.stdin.read()
+        else:
+            req['file'] = os.path.abspath(args.file)
+        try:
+            sys.stdout.write(request(req, args.socket))
+        except socket.error:
+            solve_locally(req)
@@ -0,0 +1,111 @@
+"""
+A long-lived Polya server. It imports Polya and the parser once, and then answers requests from
+polya_client.py over a Unix socket, or line by line over stdin/stdout. Each request is solved in
+a forked child, so one problem cannot leave state behind for the next, and a crash or timeout
+only takes down that child.
+
+A request is one line of JSON with the keys of polya_client.request: file (or input, the text of
+the problem), timeout, force_fm, force_smt, z3out, workers, portfolio, auto and memory. The
+answer is the line single_translate.py would print.
+"""
+import argparse
+import json
+import os
+import signal
+import SocketServer
+import sys
+import tempfile
+import single_translate
+from polya_client import default_socket
+
+
+def answer(req):
+    """
+    Solves the request dictionary req in this process, and returns the output line.
+    """
+    r = 0
+    file = req.get('file')
+    if 'input' in req:
+        with tempfile.NamedTemporaryFile(suffix='.smt2', delete=False) as f:
+            f.write(req['input'])
+        file = f.name
+    try:
+        r = single_translate.solve(file, (req.get('timeout') or single_translate.timeout),
+                                   req.get('force_fm', False), req.get('force_smt', False),
+                                   workers=req.get('workers', 1),
+                                   portfolio=req.get('portfolio', False),
+                                   solver_type=('auto' if req.get('auto') else None),
+                                   memory=req.get('memory'))
+    except SystemExit:
+        r = 0
+    finally:
+        if 'input' in req:
+            os.remove(file)
+    return single_translate.format_result(r, req.get('z3out', False))
+
+
+class PolyaRequestHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            req = json.loads(self.rfile.readline())
+        except ValueError:
+            req = {}
+        out = answer(req) if 'file' in req or 'input' in req else \
+            single_translate.format_result(0, req.get('z3out', False))
+        self.wfile.write(out + '\n')
+
+
+class PolyaServer(SocketServer.ForkingMixIn, SocketServer.UnixStreamServer):
+    pass
+
+
+def serve_socket(path=default_socket):
+    if os.path.exists(path):
+        os.remove(path)
+    server = PolyaServer(path, PolyaRequestHandler)
+    signal.signal(signal.SIGTERM, lambda num, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(path)
+
+
+def serve_stdio(infile=sys.stdin, outfile=sys.stdout):
+    """
+    Answers one request per line of infile, writing one line per answer to outfile.
+    """
+    for line in iter(infile.readline, ''):
+        if not line.strip():
+            continue
+        outfile.flush()
+        rfd, wfd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(rfd)
+            try:
+                out = answer(json.loads(line))
+            except BaseException:
+                out = single_translate.format_result(0)
+            os.write(wfd, out + '\n')
+            os._exit(0)
+        os.close(wfd)
+        with os.fdopen(rfd) as f:
+            out = f.read()
+        os.waitpid(pid, 0)
+        outfile.write(out or single_translate.format_result(0) + '\n')
+        outfile.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Answer Polya requests from polya_client.py.")
+    parser.add_argument('--socket', default=default_socket,
+                        help="socket to listen on (default: {0})".format(default_socket))
+    parser.add_argument('--stdio', action="store_true",
+                        help="read requests from stdin and answer on stdout instead")
+    args = parser.parse_args()
+    if args.stdio:
+        serve_stdio()
+    else:
+        serve_socket(args.socket)
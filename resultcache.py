@@ -0,0 +1,98 @@
+"""
+A cache of check-sat answers, shared by all runs and processes that use the same file.
+
+An answer is keyed by a hash of the declarations and assertions in scope at the check-sat,
+taken in sorted order, together with the solver settings and the Polya version. 1 and -1 are
+stored as they are. A timeout is stored with the time that was left for the check-sat when it
+ran out, and only answers later check-sats with no more time left.
+
+The cache is an sqlite database, so any number of processes may read and write it at once.
+"""
+
+import hashlib
+import os
+import sqlite3
+import time
+
+import polya
+
+TIMEOUT = 0
+
+
+def polya_version():
+    """
+    Returns polya.__version__, or if there is none, a hash of Polya's source files.
+    """
+    if getattr(polya, '__version__', None):
+        return str(polya.__version__)
+    h = hashlib.sha1()
+    root = os.path.dirname(polya.__file__)
+    for dirpath, _, filenames in sorted(os.walk(root)):
+        for name in sorted(filenames):
+            if name.endswith('.py'):
+                with open(os.path.join(dirpath, name), 'rb') as f:
+                    h.update(f.read())
+    return h.hexdigest()
+
+
+class ResultCache(object):
+    """
+    The cache in the sqlite database at path. Each process opens its own connection when it
+    first uses the cache, so a ResultCache may be created before forking.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.version = None
+        self.conn = None
+        self.pid = None
+
+    def connect(self):
+        if self.conn is None or self.pid != os.getpid():
+            self.conn = sqlite3.connect(self.path, timeout=60)
+            self.pid = os.getpid()
+            self.conn.execute('create table if not exists results ('
+                              'key text primary key, result integer, budget real, '
+                              'created real)')
+            self.conn.commit()
+        return self.conn
+
+    def key(self, context, force_fm):
+        """
+        Returns the key for a check-sat of the commands in context with the given settings.
+        """
+        if self.version is None:
+            self.version = polya_version()
+        h = hashlib.sha1()
+        h.update('{0}\n{1}\n'.format('fm' if force_fm else 'poly', self.version))
+        for s in sorted(context):
+            h.update(s)
+            h.update('\n')
+        return h.hexdigest()
+
+    def lookup(self, key):
+        """
+        Returns (result, budget) for key, or None. budget is None unless result is TIMEOUT.
+        """
+        conn = self.connect()
+        return conn.execute('select result, budget from results where key = ?',
+                            (key,)).fetchone()
+
+    def store(self, key, result):
+        conn = self.connect()
+        with conn:
+            conn.execute('insert or replace into results values (?, ?, NULL, ?)',
+                         (key, result, time.time()))
+
+    def store_timeout(self, key, budget):
+        """
+        Records that the check-sat for key ran out of a limit of budget seconds, unless an
+        answer or a timeout with a larger limit is stored already.
+        """
+        conn = self.connect()
+        with conn:
+            conn.execute('insert or ignore into results values (?, ?, ?, ?)',
+                         (key, TIMEOUT, budget, time.time()))
+            conn.execute('update results set budget = ? '
+                         'where key = ? and result = ? and budget < ?',
+                         (budget, key, TIMEOUT, budget))
@@ -0,0 +1,107 @@
+"""
+Runs Polya on SMT-LIB v2 problems inside the current process, without global state.
+
+A Session holds the options for its runs. Each call to solve_file, solve_string or solve_bytes
+creates its own parser and translation state, and drops both when it returns. Errors come
+back in the Result instead of being printed or passed to sys.exit. One process, or several
+threads in it, can therefore run any number of problems while its memory stays flat.
+
+The solver choice is a global setting inside Polya itself. Threads that share a process
+should therefore use the same solver.
+"""
+import os
+
+import topolya
+from parser2 import astarray
+from parser2.ddsmtparser import DDSMTParser, DDSMTParseException
+from stats import Stats
+
+
+class Result(object):
+    """
+    The outcome of one problem.
+    - value is 1, -1 or 0, as topolya.translate_smt_node returns.
+    - error is the class name of the exception that ended the run early, if any, and message
+      says what went wrong.
+    - fatal is true if the problem could not be read or parsed, as opposed to failing in the
+      translation or in Polya.
+    - stats holds the timers and counters of the run.
+    """
+
+    def __init__(self, stats, value=0, error=None, message=None, fatal=False):
+        self.stats = stats
+        self.value = value
+        self.error = error
+        self.message = message
+        self.fatal = fatal
+
+
+class Session(object):
+    """
+    Options shared by a series of runs. parse_cache is a parsecache.ParseCache or None. If
+    compact is true, the terms of the input are kept in a parser2.astarray.ASTStore rather than
+    as a node object each. Further keyword arguments, such as lazy, workers, result_cache,
+    timeout and solver_type, are passed on to topolya.translate_smt_node.
+    """
+
+    def __init__(self, force_fm=False, force_smt=False, parse_cache=None, compact=False,
+                 **options):
+        self.force_fm = force_fm
+        self.force_smt = force_smt
+        self.parse_cache = parse_cache
+        self.compact = compact
+        self.options = options
+
+    def solve_file(self, filename, stats=None):
+        """
+        Solves the problem in filename, or on stdin if it is "STDIN". If stats is a
+        stats.Stats, the timers and counters of the run are added to it.
+        """
+        if filename != "STDIN":
+            if not os.path.exists(filename):
+                return self._input_error(stats, "given input file does not exist")
+            elif os.path.isdir(filename):
+                return self._input_error(stats, "given input file is a directory")
+        return self._solve(filename, None, stats)
+
+    def solve_string(self, text, name='<string>', stats=None):
+        """
+        Solves the problem in the string text. name stands for the file name in messages.
+        """
+        return self._solve(name, text, stats)
+
+    def solve_bytes(self, data, name='<bytes>', stats=None):
+        """
+        Solves the problem in data, a bytearray, buffer or other object that str() gives the
+        bytes of.
+        """
+        return self._solve(name, str(data), stats)
+
+    def _input_error(self, stats, message):
+        stats = stats if stats is not None else Stats()
+        stats.error = 'IOError'
+        return Result(stats, error='IOError', message='[ddsmt] Error: ' + message, fatal=True)
+
+    def _solve(self, filename, text, stats):
+        stats = stats if stats is not None else Stats()
+        result = Result(stats)
+        if self.parse_cache and filename != "STDIN":
+            cmds = self.parse_cache.iter_commands(filename, stats, text, self.compact)
+        else:
+            parser = DDSMTParser(lean=True,
+                                 store=astarray.ASTStore() if self.compact else None)
+            parser.stats = stats
+            cmds = parser.iter_commands(filename, text)
+        try:
+            result.value = topolya.translate_smt_node(cmds, self.force_fm, self.force_smt,
+                                                      stats=stats, **self.options)
+        except DDSMTParseException as e:
+            result.error, result.message, result.fatal = type(e).__name__, str(e), True
+        except Exception as e:
+            result.error, result.message = type(e).__name__, e.message
+        finally:
+            # stops the parser where the translation stopped, and lets go of its formula
+            cmds.close()
+        if result.error:
+            stats.error = result.error
+        return result
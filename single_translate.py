@@ -1,56 +1,75 @@
 import argparse
 timeout = 10  # in seconds
+memory_limit = None  # in megabytes
 force_fm = True  # If true, will force Polya to use Fourier Motzkin methods. Otherwise, will use
                   # polytope methods if available.
 force_smt = False  # If true, will produce smt2 format output when simplify is called
 
 import smtlib2polya
 import sys
+from parser2.parsecache import ParseCache
+from resultcache import ResultCache
+from stats import Stats
 import signal
-from os import listdir, devnull
+import supervise
+from os import listdir
 from os.path import isfile, join
-from timeit import default_timer
+from topolya import TimerException
 stdout = sys.stdout
 
 
-class TimerException(Exception):
-    def __init__(self):
-        super(TimerException, self).__init__()
+#sys.stdout = open(output, 'w')
 
 
-def alert(num, frame):
-    print "Error: timed out!"
-    raise TimerException
+def run(file, forcefm, forcesmt, kwargs):
+    # in the supervised child; stats are returned since the parent's copy is not filled in
+    r = smtlib2polya.run_smt_file(file, forcefm, forcesmt, **kwargs)
+    return r, kwargs.get('stats')
 
 
-#sys.stdout = open(output, 'w')
+def solve(file, time, forcefm, forcesmt, memory=None, **kwargs):
+    """
+    Runs Polya on file in a child process with a limit of time seconds of CPU time (and one more
+    of wall-clock time) and memory megabytes, discarding Polya's own output. Returns 1, -1 or 0
+    as smtlib2polya.run_smt_file does, which is passed any further keyword arguments, or
+    supervise.TIMEOUT or supervise.MEMOUT if the run reached a limit.
+    """
+    kwargs['timeout'] = time
+    outcome = supervise.run(run, (file, (forcefm or force_fm), (forcesmt or force_smt), kwargs),
+                            wall=time + 1, cpu=time,
+                            memory=(memory or memory_limit) and (memory or memory_limit) * 2**20,
+                            cpu_exception=TimerException)
+    r = 0
+    if isinstance(outcome.value, tuple):
+        r, stats = outcome.value
+        if stats:
+            kwargs['stats'].merge(stats)
+            if stats.error == TimerException.__name__:
+                r = supervise.TIMEOUT
+    if outcome.status in (supervise.TIMEOUT, supervise.MEMOUT):
+        r = outcome.status
+    elif outcome.status != supervise.OK:
+        r = 0
+    return r
 
 
-def batch_test(file, time, forcefm, forcesmt, z3out=False):
-    results = {-1: 0, 0: 0, 1: 0}
-    sys.stdout = open(devnull, 'w')
-    timer = default_timer()
+def format_result(r, z3out=False):
+    """
+    Returns the line printed for result r, either as 1/-1/0 or in z3 style. A timeout or memout
+    is 0 in the first.
+    """
+    if z3out:
+        return {1: "unsat", 0: "Fail", -1: "unknown",
+                supervise.TIMEOUT: "timeout", supervise.MEMOUT: "memout"}[r]
+    return str(r if r in (1, -1) else 0)
+
+
+def batch_test(file, time, forcefm, forcesmt, z3out=False, **kwargs):
     r = 0
-    # f = open(file, "r")
-    # print f.read()
-    # f.close()
     try:
-        signal.signal(signal.SIGALRM, alert)
-        signal.alarm(timeout)
-        r = smtlib2polya.run_smt_file(file, (forcefm or force_fm), (forcesmt or force_smt))
-    except Exception as e:
-        r = 0
+        r = solve(file, time, forcefm, forcesmt, **kwargs)
     finally:
-        sys.stdout = stdout
-        if z3out:
-            if r == 1:
-                print "unsat"
-            elif r == 0:
-                print "Fail"
-            elif r == -1:
-                print "unknown"
-        else:
-            print r
+        print format_result(r, z3out)
 
 def interrupt_handler(signal, frame):
     sys.exit(1)
@@ -66,8 +85,31 @@ if __name__ == '__main__':
     parser.add_argument('-s', action="store_true",  help="force SMT output from simplify")
     parser.add_argument('-version', action="store_true", help="version")
     parser.add_argument('-z', action="store_true", help="z3-style output")
+    parser.add_argument('-j', type=int, default=1,
+                        help="number of processes to test disjuncts with")
+    parser.add_argument('-p', action="store_true",
+                        help="portfolio: race the FM and polytope solvers")
+    parser.add_argument('-a', action="store_true",
+                        help="choose the FM or polytope solver from features of the problem")
+    parser.add_argument('--parse-cache', metavar='DIR', help="cache parsed files in DIR")
+    parser.add_argument('--result-cache', metavar='FILE',
+                        help="cache check-sat answers in the sqlite database FILE")
+    parser.add_argument('-m', type=int, help="memory limit (in MB)")
+    parser.add_argument('--compact-ast', action="store_true",
+                        help="keep the terms of the input in compact arrays")
+    parser.add_argument('--stats', action="store_true",
+                        help="print phase timers and counters to stderr")
     args = parser.parse_args()
     if args.version:
         print '0.1'
     else:
-        batch_test(args.file, (args.t if args.t else timeout), args.f, args.s, args.z)
\ No newline at end of file
+        stats = Stats() if args.stats else None
+        try:
+            batch_test(args.file, (args.t if args.t else timeout), args.f, args.s, args.z,
+                       workers=args.j, portfolio=args.p, solver_type=('auto' if args.a else None),
+                       parse_cache=(ParseCache(args.parse_cache) if args.parse_cache else None),
+                       result_cache=(ResultCache(args.result_cache) if args.result_cache else None),
+                       memory=args.m, stats=stats, compact=args.compact_ast)
+        finally:
+            if stats:
+                sys.stderr.write(stats.report() + '\n')
\ No newline at end of file
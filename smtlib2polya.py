@@ -19,19 +19,24 @@
 # along with ddSMT.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import multiprocessing
 import os
+import Queue
 import random
 import resource
+import signal
 import sys
 import shutil
+import StringIO
 import time
-import topolya
 import tempfile
 
 from argparse import ArgumentParser, REMAINDER
 from subprocess import Popen, PIPE
 from threading import Thread
-from parser2.ddsmtparser import DDSMTParser, DDSMTParseException
+from parser2.ddsmtparser import DDSMTParseException
+from session import Session
+from stats import Stats
 
 
 __version__ = "0.98-beta"
@@ -572,9 +577,11 @@ def ddsmt_main ():
 
 
 
-def execute_parse(args, force_fm=False, force_smt=False):
+def execute_parse(args, force_fm=False, force_smt=False, parse_cache=None, stats=None,
+                  **kwargs):
     """
-    Assumes first arg to args is python file name.
+    The command line of ddSMT: assumes first arg to args is python file name, checks the
+    arguments and runs run_smt_file on the input file with the other arguments.
     """
     global g_args
     try:
@@ -627,71 +634,119 @@ def execute_parse(args, force_fm=False, force_smt=False):
             _log (1, "output file: '{}'".format(g_args.outfile))
             _log (1, "command:     '{}'".format(
                 " ".join([str(c) for c in g_args.cmd])))
-            # if g_args.infile == "STDIN":
-            #     tfname = "/tmp/ddsmttmp-" + str(os.getpid()) + ".txt"
-            #     tf = open(tfname, 'w')
-            #     for line in sys.stdin:
-            #         tf.write(line)
-            #     tf.close()
-            #     infile = tfname
-            # else:
-            infile = g_args.infile
-
-            # ifilesize = os.path.getsize(infile)
-            parser = DDSMTParser()
-            g_smtformula = parser.parse(infile)
-            #if g_args.infile == "STDIN":
-            #    os.remove(tfname)
-
-        #  self.logic = "none"
-        #self.scopes = SMTScopeNode ()
-        #self.cur_scope = self.scopes
-        #self.subst_scopes = SMTScopeSubstList ()
-        #self.subst_cmds = SMTCmdSubstList ()
-        #self.subst_nodes = SMTNodeSubstList ()
-        #self.sorts_cache = {}
-        #self.consts_cache = {}
-        # #self
-        #     print ('logic:', g_smtformula.logic)
-        #     print ('scopes:', g_smtformula.scopes)
-            s = g_smtformula.scopes
-        #     print ('scope level:', s.level)
-        #     print ('prev:', s.prev)
-        #     print ('scope.scopes:', s.scopes)
-        #     print ('scope.cmds:')
-        #     for (i, c) in enumerate(s.cmds):
-        #     	print (i)
-        #     	print (c)
-        #     	print (c.id, c.kind, c.children)
-        #     print ('scope.funs:', s.funs)
-            #print ('cur_scope:', g_smtformula.cur_scope)
-            #print ('subst_scopes:', g_smtformula.subst_scopes.substs)
-            #print ('subst_cmds:', g_smtformula.subst_cmds.substs)
-            #print ('subst_nodes:', g_smtformula.subst_nodes.substs)
-            #print ('iterating through subst_nodes')
-
-            # print ('\n\n\n')
-            try:
-                return topolya.translate_smt_node(s.cmds, force_fm, force_smt)
-            except Exception as e:
-                print 'Polya has failed, for reason:'
-                print e.message
-                print
-                return 0
+            return run_smt_file(g_args.infile, force_fm, force_smt, parse_cache,
+                                stats=stats, **kwargs)
 
     except (DDSMTParseException, DDSMTException) as e:
+        if stats is not None:
+            stats.error = type(e).__name__
         _cleanup()
         sys.exit(str(e))
     except MemoryError as e:
+        if stats is not None:
+            stats.error = type(e).__name__
         _cleanup()
         sys.exit("[ddsmt] memory exhausted")
     except KeyboardInterrupt as e:
         _cleanup()
         sys.exit("[ddsmt] interrupted")
 
-def run_smt_file(filename, force_fm=False, force_smt=False):
-    args = ['smtlib2polya.py', filename, 'EMPTY', 'echo']
-    return execute_parse(args, force_fm, force_smt)
+def run_smt_file(filename, force_fm=False, force_smt=False, parse_cache=None, portfolio=False,
+                 stats=None, **kwargs):
+    """
+    Runs Polya on filename, and returns 1, -1 or 0 as topolya.translate_smt_node does. If
+    portfolio is true, force_fm is ignored and both solvers are raced, see run_portfolio.
+
+    If parse_cache is a ParseCache, the parsed input file is looked up there first. If stats is
+    a stats.Stats, the timers and counters of the run are added to it, and its error is set to
+    the class name of an exception that ends the run. Further keyword arguments are passed on
+    to topolya.translate_smt_node.
+
+    Unlike a session.Session, prints why a run failed, and calls sys.exit if the file cannot be
+    read or parsed.
+    """
+    if portfolio:
+        return run_portfolio(filename, force_smt, parse_cache, stats, **kwargs)
+    result = Session(force_fm, force_smt, parse_cache, **kwargs).solve_file(filename, stats)
+    if result.fatal:
+        sys.exit(result.message)
+    if result.error:
+        print 'Polya has failed, for reason:'
+        print result.message
+        print
+    return result.value
+
+
+def run_portfolio(filename, force_smt=False, parse_cache=None, stats=None, **kwargs):
+    """
+    Runs Polya on filename with the polytope and the Fourier-Motzkin solver at once, in two
+    forked processes. Returns 1 as soon as either finds the problem unsatisfiable, and kills
+    the other. Otherwise returns -1 if either returned -1, and 0 if neither did. The output of
+    the run whose result is returned is printed, and its stats are added to stats.
+    """
+    # each process runs one solver, so a solver_type other than fm and poly makes no sense here
+    kwargs.pop('solver_type', None)
+    if filename == "STDIN":
+        # both processes need to read the problem
+        with tempfile.NamedTemporaryFile(suffix='.smt2', delete=False) as f:
+            shutil.copyfileobj(sys.stdin, f)
+        try:
+            return run_portfolio(f.name, force_smt, parse_cache, stats, **kwargs)
+        finally:
+            os.remove(f.name)
+
+    answers = multiprocessing.Queue()
+
+    def run(fm):
+        # exits with code 0 when killed, after the finally blocks have stopped any workers
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        out = StringIO.StringIO()
+        sys.stdout = out
+        run_stats = Stats() if stats is not None else None
+        try:
+            r = run_smt_file(filename, fm, force_smt, parse_cache, stats=run_stats, **kwargs)
+            answers.put((fm, r, out.getvalue(), None, run_stats))
+        except SystemExit as e:
+            if e.code:
+                answers.put((fm, 0, out.getvalue(), e.code, run_stats))
+        except Exception as e:
+            answers.put((fm, 0, out.getvalue() + 'Error: {0}\n'.format(e), None, run_stats))
+
+    sys.stdout.flush()
+    procs = [multiprocessing.Process(target=run, args=(fm,)) for fm in (False, True)]
+    for proc in procs:
+        proc.start()
+    try:
+        results = []
+        while len(results) < len(procs):
+            try:
+                fm, r, out, exit_msg, run_stats = answers.get(timeout=0.1)
+            except Queue.Empty:
+                if not any(proc.is_alive() for proc in procs) and answers.empty():
+                    break
+                continue
+            if exit_msg is not None:
+                # the file does not parse, which is the same for both solvers
+                sys.stdout.write(out)
+                sys.exit(exit_msg)
+            results.append((fm, r, out, run_stats))
+            if r == 1:
+                break
+        if not results:
+            raise Exception('both portfolio processes died')
+        rank = {1: 2, -1: 1, 0: 0}
+        fm, r, out, run_stats = max(results, key=lambda res: rank[res[1]])
+        sys.stdout.write(out)
+        if run_stats:
+            stats.merge(run_stats)
+            stats.error = run_stats.error
+        print 'Portfolio: result from the {0} solver.'.format('fm' if fm else 'poly')
+        return r
+    finally:
+        for proc in procs:
+            if proc.is_alive():
+                proc.terminate()
+            proc.join()
 
 
 if __name__ == "__main__":
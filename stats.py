@@ -0,0 +1,93 @@
+"""
+Timers and counters for the phases of a run: tokenizing, the parse actions, translation, the
+pnf and dnf normal forms, copying Examples and Polya's tests.
+
+Timers measure self time: while a phase runs inside another, only the inner one is charged, so
+the timers of a run add up to its total time. A Stats can be merged into another, to sum the
+runs of a batch.
+"""
+import contextlib
+from timeit import default_timer
+
+# The order phases and counters are reported in. Others follow, sorted by name.
+PHASES = ['tokenize', 'parse', 'translate', 'pnf', 'dnf', 'deepcopy', 'test']
+COUNTERS = ['files', 'commands', 'assertions', 'formula nodes', 'let bindings', 'term nodes',
+            'term cache hits', 'shared terms', 'check-sats', 'poly check-sats', 'fm check-sats',
+            'disjuncts', 'axioms', 'copies']
+
+
+class Stats(object):
+    """
+    The timers (in seconds) and counters of one or more runs. error is the class name of the
+    exception that ended a run early, if any; it is not merged.
+    """
+
+    def __init__(self):
+        self.timers = {}
+        self.counts = {}
+        self.error = None
+        self.stack = []
+        self.since = None
+
+    def start(self, phase):
+        now = default_timer()
+        if self.stack:
+            self._charge(self.stack[-1], now)
+        self.stack.append(phase)
+        self.since = now
+
+    def stop(self):
+        now = default_timer()
+        self._charge(self.stack.pop(), now)
+        self.since = now
+
+    def _charge(self, phase, now):
+        self.timers[phase] = self.timers.get(phase, 0) + now - self.since
+
+    @contextlib.contextmanager
+    def timer(self, phase):
+        self.start(phase)
+        try:
+            yield
+        finally:
+            self.stop()
+
+    def timed(self, phase, iterable):
+        """
+        Yields the elements of iterable, charging the time taken to produce each to phase.
+        """
+        it = iter(iterable)
+        while True:
+            self.start(phase)
+            try:
+                x = next(it)
+            except StopIteration:
+                return
+            finally:
+                self.stop()
+            yield x
+
+    def add(self, counter, n=1):
+        self.counts[counter] = self.counts.get(counter, 0) + n
+
+    def merge(self, other):
+        for phase, t in other.timers.items():
+            self.timers[phase] = self.timers.get(phase, 0) + t
+        for counter, n in other.counts.items():
+            self.add(counter, n)
+
+    def report(self):
+        """
+        Returns the timers and counters as lines of text.
+        """
+        def order(names, known):
+            return [n for n in known if n in names] + sorted(set(names) - set(known))
+        total = sum(self.timers.values())
+        lines = ['Stats:']
+        for phase in order(self.timers, PHASES):
+            t = self.timers[phase]
+            lines.append('  {0:<16}{1:>10.3f}s {2:>6.1%}'.format(
+                phase, t, t / total if total else 0))
+        for counter in order(self.counts, COUNTERS):
+            lines.append('  {0:<16}{1:>10}'.format(counter, self.counts[counter]))
+        return '\n'.join(lines)
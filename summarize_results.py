@@ -0,0 +1,205 @@
+"""
+Summarizes the JSONL results batch_translate.py --jsonl writes, or compares two of them.
+
+With one file, prints the number of files by result, the timeouts and errors, and percentiles
+of the wall and CPU time, the peak RSS and each phase.
+
+With --merge OUT, any number of files, such as the shards of one run, are merged into OUT,
+which is then summarized.
+
+With two files, the first is taken as the baseline. Prints the files whose result got worse or
+better, and those whose wall time grew or shrank by more than the given ratio, then the change
+of each percentile. The exit code is 1 if some result got worse or some file got slower, so the
+comparison can be run as a check.
+
+Usage:
+  python summarize_results.py results.jsonl
+  python summarize_results.py [--ratio 1.5] [--min-time 0.1] old.jsonl new.jsonl
+  python summarize_results.py --merge all.jsonl shard0.jsonl shard1.jsonl ...
+"""
+import argparse
+import json
+import math
+import sys
+
+PERCENTILES = [50, 90, 95, 99, 100]
+results_names = {1: 'unsat', -1: 'failed', 0: 'error or time'}
+# A result is better the higher its rank.
+rank = {1: 2, -1: 1, 0: 0}
+
+
+def read_results(path):
+    """
+    Returns a dictionary from file names to their records. A file that appears more than once
+    keeps its last record. A line that is cut short, as the last one of a run that died may
+    be, is skipped.
+    """
+    records = {}
+    with open(path) as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            records[rec['file']] = rec
+    return records
+
+
+def merge(paths, out):
+    """
+    Writes the records of all the results files in paths to out, and returns them. A file that
+    appears in several keeps its record from the last.
+    """
+    records = {}
+    for path in paths:
+        records.update(read_results(path))
+    with open(out, 'w') as f:
+        for name in sorted(records):
+            f.write(json.dumps(records[name], sort_keys=True) + '\n')
+    return records
+
+
+def percentile(values, p):
+    """
+    Returns the p-th percentile of values by the nearest-rank method, or None if it is empty.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    k = max(0, int(math.ceil(p / 100.0 * len(values))) - 1)
+    return values[k]
+
+
+def distributions(records):
+    """
+    Returns a list of (name, values) for every measured quantity in records.
+    """
+    dists = [('wall', [r['wall'] for r in records if r.get('wall') is not None]),
+             ('cpu', [r['cpu'] for r in records if r.get('cpu') is not None]),
+             ('max_rss_kb', [r['max_rss_kb'] for r in records
+                             if r.get('max_rss_kb') is not None])]
+    phases = sorted(set(p for r in records for p in r.get('phases', {})))
+    for p in phases:
+        dists.append(('phase ' + p, [r['phases'].get(p, 0.0) for r in records]))
+    return dists
+
+
+def format_row(name, values, width=12):
+    cells = ''.join('{0:>{1}}'.format(fmt(v), width) for v in values)
+    return '  {0:<20}{1}'.format(name, cells)
+
+
+def fmt(v):
+    if v is None:
+        return '-'
+    if isinstance(v, float):
+        return '{0:.3f}'.format(v)
+    return str(v)
+
+
+def header(width=12):
+    return format_row('', ['p{0}'.format(p) if p < 100 else 'max' for p in PERCENTILES], width)
+
+
+def summarize(records):
+    """
+    Returns the summary of one run as lines of text.
+    """
+    records = records.values()
+    lines = ['{0} files'.format(len(records))]
+    for r in (1, -1, 0):
+        lines.append('  {0:<20}{1:>6}'.format(
+            results_names[r], sum(1 for rec in records if rec['result'] == r)))
+    lines.append('  {0:<20}{1:>6}'.format(
+        'timeouts', sum(1 for rec in records if rec['timeout'])))
+    lines.append('  {0:<20}{1:>6}'.format(
+        'memouts', sum(1 for rec in records if rec.get('status') == 'memout')))
+    errors = {}
+    for rec in records:
+        if rec['error'] and not rec['timeout']:
+            errors[rec['error']] = errors.get(rec['error'], 0) + 1
+    for e in sorted(errors):
+        lines.append('  {0:<20}{1:>6}'.format(e, errors[e]))
+    lines.append('')
+    lines.append(header())
+    for name, values in distributions(records):
+        lines.append(format_row(name, [percentile(values, p) for p in PERCENTILES]))
+    return lines
+
+
+def compare(old, new, ratio, min_time):
+    """
+    Returns the comparison of the runs old and new as lines of text, and whether new has
+    regressed.
+    """
+    lines = []
+    common = sorted(set(old) & set(new))
+    worse = [f for f in common if rank[new[f]['result']] < rank[old[f]['result']]]
+    better = [f for f in common if rank[new[f]['result']] > rank[old[f]['result']]]
+    slower, faster = [], []
+    for f in common:
+        if new[f]['result'] != old[f]['result']:
+            continue
+        t0, t1 = old[f]['wall'], new[f]['wall']
+        if max(t0, t1) < min_time:
+            continue
+        if t1 > t0 * ratio:
+            slower.append((f, t0, t1))
+        elif t0 > t1 * ratio:
+            faster.append((f, t0, t1))
+
+    def result_changes(title, files):
+        lines.append('{0}: {1}'.format(title, len(files)))
+        for f in files:
+            lines.append('  {0}: {1} -> {2}'.format(
+                f, results_names[old[f]['result']], results_names[new[f]['result']]))
+
+    def time_changes(title, changes):
+        lines.append('{0}: {1}'.format(title, len(changes)))
+        for f, t0, t1 in sorted(changes, key=lambda c: c[2] / max(c[1], 1e-9), reverse=True):
+            lines.append('  {0}: {1:.3f}s -> {2:.3f}s'.format(f, t0, t1))
+
+    result_changes('Worse results', worse)
+    result_changes('Better results', better)
+    time_changes('Slower by more than {0}x'.format(ratio), slower)
+    time_changes('Faster by more than {0}x'.format(ratio), faster)
+    only_old, only_new = len(set(old) - set(new)), len(set(new) - set(old))
+    if only_old or only_new:
+        lines.append('{0} files only in the baseline, {1} only in the new run'.format(
+            only_old, only_new))
+
+    lines.append('')
+    lines.append('Files in both runs: old / new')
+    lines.append(header(20))
+    old_dists = dict(distributions([old[f] for f in common]))
+    for name, values in distributions([new[f] for f in common]):
+        before = old_dists.get(name, [])
+        lines.append(format_row(name, ['{0} / {1}'.format(fmt(percentile(before, p)),
+                                                         fmt(percentile(values, p)))
+                                       for p in PERCENTILES], 20))
+    return lines, bool(worse or slower)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Summarize or compare batch results.")
+    parser.add_argument('results', nargs='+', metavar='results.jsonl',
+                        help="one run to summarize, or a baseline and a new run to compare")
+    parser.add_argument('--ratio', type=float, default=1.5,
+                        help="wall time ratio that counts as a change (default: 1.5)")
+    parser.add_argument('--merge', metavar='OUT',
+                        help="merge all the results files into OUT and summarize it")
+    parser.add_argument('--min-time', type=float, default=0.1,
+                        help="ignore time changes of files faster than this in both runs "
+                             "(default: 0.1)")
+    args = parser.parse_args()
+    if args.merge:
+        print '\n'.join(summarize(merge(args.results, args.merge)))
+    elif len(args.results) == 1:
+        print '\n'.join(summarize(read_results(args.results[0])))
+    elif len(args.results) == 2:
+        lines, regressed = compare(read_results(args.results[0]), read_results(args.results[1]),
+                                   args.ratio, args.min_time)
+        print '\n'.join(lines)
+        sys.exit(1 if regressed else 0)
+    else:
+        parser.error("expected one or two results files")
@@ -0,0 +1,219 @@
+"""
+Runs a function in a forked child process under wall-clock, CPU-time and memory limits, and
+reports how it ended.
+
+The parent enforces the wall-clock limit, and the memory limit where /proc shows it, by killing
+the child's process group, so processes the child started go too. The memory counted is that of
+the whole group, so it includes the processes the child forked. The CPU limit is an
+RLIMIT_CPU: the child gets SIGXCPU when it runs out, which can be turned into an exception so
+the child can clean up, and is killed a second later if it does not stop. Where /proc is
+missing, the memory limit is an RLIMIT_AS instead.
+
+Nothing here uses SIGALRM, so the caller may be in any thread.
+"""
+import cPickle
+import os
+import resource
+import select
+import signal
+import StringIO
+import sys
+from timeit import default_timer
+
+OK = 'ok'              # the function returned; value is what it returned
+TIMEOUT = 'timeout'    # the wall-clock or CPU limit was reached
+MEMOUT = 'memout'      # the memory limit was reached
+ERROR = 'error'        # the function raised an exception; error is its class name
+EXIT = 'exit'          # the function called sys.exit with a message or a nonzero code
+CRASH = 'crash'        # the child died without an answer
+
+# In seconds, how often the parent checks the memory of the child's process group: first
+# every poll_interval, then twice as long after each check, up to max_poll_interval. Each check
+# reads the status of every process in /proc, so long runs are checked less often.
+poll_interval = 0.05
+max_poll_interval = 0.5
+
+
+class Outcome(object):
+    """
+    How a supervised run ended: its status, the value returned or the exit code, the output it
+    printed, the class name of the exception it raised, and the wall-clock time, CPU time and
+    peak resident set size (in kilobytes) it used.
+    """
+
+    def __init__(self, status, value=None, output='', error=None):
+        self.status = status
+        self.value = value
+        self.output = output
+        self.error = error
+        self.wall = None
+        self.cpu = None
+        self.max_rss_kb = None
+
+
+def _rss(pid):
+    """
+    Returns the resident set size of pid in bytes, or None if /proc does not show it.
+    """
+    try:
+        with open('/proc/{0}/statm'.format(pid)) as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+
+
+def _pss(pid):
+    """
+    Returns the proportional set size of pid in bytes: its resident memory, with each page it
+    shares counted in part, so that a forked process and its parent together count the pages
+    they still share once. Falls back to the resident set size where /proc does not show it.
+    """
+    try:
+        with open('/proc/{0}/smaps_rollup'.format(pid)) as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, IndexError, ValueError):
+        pass
+    return _rss(pid)
+
+
+def _group_rss(pgid):
+    """
+    Returns the memory used by the processes of process group pgid in bytes, summed over them
+    (see _pss), or None if /proc does not show it. The group holds the supervised child and the
+    processes it forked, such as branch workers and portfolio solvers.
+    """
+    try:
+        pids = [int(p) for p in os.listdir('/proc') if p.isdigit()]
+    except OSError:
+        return None
+    total = None
+    for pid in pids:
+        try:
+            with open('/proc/{0}/stat'.format(pid)) as f:
+                stat = f.read()
+            # the fields after the command name, which may contain spaces, start with the
+            # state, the parent pid and the process group
+            if int(stat[stat.rindex(')') + 2:].split()[2]) != pgid:
+                continue
+        except (IOError, OSError, IndexError, ValueError):
+            continue    # it has exited
+        size = _pss(pid)
+        if size is not None:
+            total = (total or 0) + size
+    return total
+
+
+def _child(fn, args, kwargs, cpu, memory, cpu_exception, w):
+    os.setpgid(0, 0)
+    if cpu:
+        soft = max(1, int(cpu + 0.999))
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, soft + 1))
+    if memory and _rss(os.getpid()) is None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+    hit_cpu = []
+
+    def on_xcpu(signum, frame):
+        hit_cpu.append(True)
+        if cpu_exception:
+            raise cpu_exception()
+    signal.signal(signal.SIGXCPU, on_xcpu)
+    out = StringIO.StringIO()
+    sys.stdout = out
+    try:
+        outcome = Outcome(OK, fn(*args, **kwargs))
+    except MemoryError:
+        outcome = Outcome(MEMOUT)
+    except SystemExit as e:
+        outcome = Outcome(EXIT if e.code else OK, e.code)
+    except BaseException as e:
+        outcome = Outcome(ERROR, str(e), error=type(e).__name__)
+    if hit_cpu:
+        outcome.status = TIMEOUT
+    outcome.output = out.getvalue()
+    try:
+        data = cPickle.dumps(outcome, 2)
+    except Exception as e:
+        data = cPickle.dumps(Outcome(ERROR, str(e), outcome.output, type(e).__name__), 2)
+    with os.fdopen(w, 'wb') as f:
+        f.write(data)
+
+
+def run(fn, args=(), kwargs=None, wall=None, cpu=None, memory=None, cpu_exception=None):
+    """
+    Calls fn(*args, **kwargs) in a forked child, with at most wall seconds of wall-clock time,
+    cpu seconds of CPU time (rounded up to whole seconds) and memory bytes of memory; None means
+    no limit. If cpu_exception is given, it is raised in the child when the CPU limit is
+    reached. fn's printed output is captured. Returns an Outcome; fn's return value must be
+    picklable.
+    """
+    sys.stdout.flush()
+    r, w = os.pipe()
+    start = default_timer()
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            os.close(r)
+            _child(fn, args, kwargs or {}, cpu, memory, cpu_exception, w)
+        except BaseException:
+            code = 1
+        finally:
+            os._exit(code)
+    os.close(w)
+    try:
+        # also set here, in case the parent gets to kill the group before the child sets it
+        os.setpgid(pid, pid)
+    except OSError:
+        pass
+
+    killed = None
+    chunks = []
+    interval = poll_interval
+    next_check = start + interval
+    with os.fdopen(r, 'rb') as f:
+        while True:
+            timeout = None if memory is None else max(0, next_check - default_timer())
+            if wall is not None:
+                left = start + wall - default_timer()
+                if left <= 0:
+                    killed = TIMEOUT
+                    break
+                timeout = left if timeout is None else min(timeout, left)
+            if select.select([f], [], [], timeout)[0]:
+                data = os.read(f.fileno(), 65536)
+                if not data:
+                    break
+                chunks.append(data)
+            if memory is not None and default_timer() >= next_check:
+                if (_group_rss(pid) or 0) > memory:
+                    killed = MEMOUT
+                    break
+                interval = min(2 * interval, max_poll_interval)
+                next_check = default_timer() + interval
+    if killed:
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except OSError:
+            pass
+    _, status, usage = os.wait4(pid, 0)
+
+    if killed:
+        outcome = Outcome(killed)
+    elif chunks:
+        try:
+            outcome = cPickle.loads(''.join(chunks))
+        except Exception:
+            outcome = Outcome(CRASH)
+    elif os.WIFSIGNALED(status) and os.WTERMSIG(status) in (signal.SIGXCPU, signal.SIGKILL) \
+            and cpu and usage.ru_utime + usage.ru_stime >= cpu:
+        outcome = Outcome(TIMEOUT)
+    else:
+        outcome = Outcome(CRASH)
+    outcome.wall = default_timer() - start
+    outcome.cpu = usage.ru_utime + usage.ru_stime
+    outcome.max_rss_kb = usage.ru_maxrss
+    if memory and outcome.status in (CRASH, ERROR, EXIT) and usage.ru_maxrss * 1024 >= memory:
+        outcome.status = MEMOUT
+    return outcome
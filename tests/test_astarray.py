@@ -0,0 +1,49 @@
+"""
+Tests of the compact term store.
+"""
+import unittest
+
+from benchmarks.generators import FAMILIES
+from parser2.astarray import ASTStore, NodeView, compact
+from parser2.ddsmtparser import DDSMTParser
+
+TEXT = '''(set-logic UFLRA)
+(declare-fun x () Real)
+(define-fun g ((a Real) (b Real)) Real (+ a (* 2 b)))
+(assert (! (exists ((u Real) (v Real))
+             (and (< u (g x v)) (let ((z (- x)) (w 3)) (> z w)))) :named foo))
+(assert (forall ((u Real)) (=> (< u x) (! (> (g u u) 0) :weight 2))))
+(check-sat)
+'''
+
+
+def parse(text, store=None):
+    return list(DDSMTParser(lean=True, store=store).iter_commands('<string>', text))
+
+
+class StoreTest(unittest.TestCase):
+
+    def assertSameText(self, text):
+        plain = [str(c) for c in parse(text)]
+        self.assertEqual([str(c) for c in parse(text, ASTStore())], plain)
+        cmds = DDSMTParser(lean=True).iter_commands('<string>', text)
+        self.assertEqual([str(c) for c in compact(cmds)], plain)
+
+    def test_generated(self):
+        for name, generate in FAMILIES:
+            self.assertSameText(generate(20))
+
+    def test_binders_and_annotations(self):
+        self.assertSameText(TEXT)
+
+    def test_parser_fills_store(self):
+        store = ASTStore()
+        cmds = parse(TEXT, store)
+        asserted = [c.children[0] for c in cmds if c.kind == 'assert']
+        self.assertTrue(all(isinstance(t, NodeView) and t.store is store
+                            for t in asserted[1:]))
+        self.assertTrue(len(store) > 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
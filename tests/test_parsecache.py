@@ -0,0 +1,43 @@
+"""
+Tests of the on-disk parse cache.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from parser2.astarray import NodeView
+from parser2.parsecache import ParseCache
+
+TEXT = '''(set-logic QF_LRA)
+(declare-fun x () Real)
+(assert (< x (+ x 1)))
+(check-sat)
+'''
+
+
+class ParseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = ParseCache(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def asserted(self, compact):
+        cmds = list(self.cache.iter_commands('<string>', text=TEXT, compact=compact))
+        return [c.children[0] for c in cmds if c.kind == 'assert'][0]
+
+    def test_compact_entries_apart(self):
+        self.assertIsInstance(self.asserted(True), NodeView)
+        self.assertNotIsInstance(self.asserted(False), NodeView)
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+        # now both from the cache
+        self.assertIsInstance(self.asserted(True), NodeView)
+        self.assertNotIsInstance(self.asserted(False), NodeView)
+        self.assertEqual(str(self.asserted(True)), str(self.asserted(False)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+"""
+Tests of the translation of SMT-LIB v2 problems. Run from the main directory, with Polya in the
+Python path, by "python -m unittest discover".
+"""
+import StringIO
+import sys
+import unittest
+
+from session import Session
+
+
+def solve(text, compact=False):
+    """
+    Solves text in a Session, and returns the Result and what was printed.
+    """
+    out = StringIO.StringIO()
+    sys.stdout, saved = out, sys.stdout
+    try:
+        result = Session(compact=compact).solve_string(text)
+    finally:
+        sys.stdout = saved
+    return result, out.getvalue()
+
+
+class DefineFunTest(unittest.TestCase):
+
+    def assertUnsat(self, text):
+        for compact in (False, True):
+            result, out = solve(text, compact)
+            self.assertIsNone(result.error, result.message)
+            self.assertEqual(result.value, 1)
+            self.assertNotIn('didnt find kind', out)
+
+    def test_numeric_body(self):
+        self.assertUnsat('(set-logic QF_UFLRA)\n'
+                         '(declare-fun x () Real)\n'
+                         '(define-fun k ((a Real)) Real 3)\n'
+                         '(assert (< (k x) x))\n'
+                         '(assert (< x 0))\n'
+                         '(check-sat)\n')
+
+    def test_nullary_bool(self):
+        self.assertUnsat('(set-logic QF_LRA)\n'
+                         '(declare-fun a () Real)\n'
+                         '(define-fun q () Bool (> a 0))\n'
+                         '(assert q)\n'
+                         '(assert (< a 0))\n'
+                         '(check-sat)\n')
+
+
+class SortTest(unittest.TestCase):
+
+    def test_int_declaration(self):
+        result, out = solve('(set-logic QF_LIA)\n'
+                            '(declare-fun x () Int)\n'
+                            '(assert (< x 0))\n'
+                            '(check-sat)\n')
+        self.assertEqual(result.error, 'UnsupportedSortException')
+        self.assertIn('Int', result.message)
+        self.assertEqual(result.value, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,26 +4,131 @@ import polya.main.terms as terms
 import polya.main.formulas as formulas
 import fractions
 import copy
-import parser2.ddsmtparser as ddsmtparser
+import multiprocessing
 import numbers
+import Queue
+import resource
+import sys
+import backend_select
+import hashcons
+from stats import Stats
 
 
-def translate_smt_node(cmds, force_fm=False, force_smt=False):
+class TimerException(Exception):
+    """
+    Raised when a file runs out of time: by the SIGXCPU handler that supervise installs when
+    its CPU limit is reached, and by check_sat when the result cache holds a timeout with at
+    least the current time limit.
+    """
+    def __init__(self):
+        super(TimerException, self).__init__()
+
+
+class UnsupportedSortException(Exception):
+    """
+    Raised when a declared function has a sort other than Real, or arguments of one.
+    """
+
+
+def cpu_time():
+    """
+    Returns the CPU time this process has used so far, in seconds.
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+class UndoDict(dict):
+    """
+    A dict that can be rolled back: after mark(), every assignment is logged, and undo() reverts
+    the assignments made since the last mark.
+    """
+
+    def __init__(self):
+        dict.__init__(self)
+        self.log = []
+        self.marks = []
+
+    def __setitem__(self, key, value):
+        if self.marks:
+            self.log.append((key, key in self, self.get(key)))
+        dict.__setitem__(self, key, value)
+
+    def mark(self):
+        self.marks.append(len(self.log))
+
+    def undo(self):
+        n = self.marks.pop()
+        while len(self.log) > n:
+            key, present, value = self.log.pop()
+            if present:
+                dict.__setitem__(self, key, value)
+            else:
+                dict.__delitem__(self, key)
+
+
+def translate_smt_node(cmds, force_fm=False, force_smt=False, lazy=False, workers=1,
+                       result_cache=None, timeout=None, solver_type=None, features=None,
+                       stats=None):
     """
     Returns 1 if the list of commands asks to check-sat an unsatisfiable problem. Returns -1 if
     Polya has tried and failed to determine unsatisfiability. Returns 0 if check-sat is never asked.
+
+    If lazy is true, disjunctive assertions are not multiplied out into Examples as they are
+    asserted. Instead, check-sat builds the Examples one at a time and stops at the first one
+    Polya fails to refute.
+
+    If workers is greater than 1, check-sat tests the Examples in that many forked processes,
+    and stops all of them as soon as one Example is not refuted.
+
+    push and pop save and restore the assertions and declarations, so each check-sat only sees
+    the ones in scope.
+
+    If result_cache is a resultcache.ResultCache, check-sat answers are looked up there before
+    Polya is run, and stored after. timeout is the CPU time limit in seconds that the caller
+    enforces on this run. A check-sat that runs out of time is stored with the part of the
+    limit that was left when it began, and such an entry only answers check-sats that have no
+    more time left.
+
+    solver_type is 'fm', 'poly' or 'auto', and defaults to 'fm' if force_fm is true and 'poly'
+    otherwise. With 'auto', each check-sat chooses the solver with backend_select from the
+    features of the problem in scope. If features is a dict, it is filled with the feature
+    values at the last check-sat.
+
+    If stats is a stats.Stats, the time spent parsing, translating, normalizing, copying and
+    testing Examples is added to its timers, and the numbers of commands, nodes, disjuncts and
+    axioms to its counters.
     """
-    if force_fm:
-        polya.set_solver_type('fm')
-    else:
-        polya.set_solver_type('poly')
+    cpu_start = cpu_time()
+    if solver_type is None:
+        solver_type = 'fm' if force_fm else 'poly'
+    if solver_type != 'auto':
+        polya.set_solver_type(solver_type)
+    if stats is None:
+        stats = Stats()
+    # The structural features backend_select chooses a solver from.
+    shape = None
+    if solver_type == 'auto' or features is not None:
+        shape = backend_select.Features()
     #e = polya.Example(conc=None)  # split_depth=2
     exlist = [polya.Example(conc=None)]
     #exs = [polya.Example(conc=None)]
+    # In lazy mode, the DNF of each disjunctive assertion. The Examples to refute are exlist
+    # times the product of these.
+    disjunctions = []
 
-    funs = {}
-    vars = {}
+    funs = UndoDict()
+    vars = UndoDict()
+    # For each function introduced by define-fun, the placeholder variables standing for its
+    # parameters and its body translated in terms of them.
+    macros = UndoDict()
     status = [0]
+    # For each open push scope, the Examples in exlist and the sizes of their hyps, axioms and
+    # clauses when it was opened. The Examples are only ever extended, or replaced by copies,
+    # so truncating them restores them.
+    scopes = []
+    # With a result cache, the text of the declarations and assertions in scope.
+    context = []
 
     smt_to_polya_comps = {
         "<=": lambda x, y: x <= y,
@@ -36,35 +141,63 @@ def translate_smt_node(cmds, force_fm=False, force_smt=False):
         "distinct": lambda l: l[0] != l[1],
 
         "abs": lambda l: abs(l[0]),
-        "+": lambda l: reduce(lambda x, y: x + y, l),
+        "+": hashcons.make_sum,
         "div": lambda l: l[0]/l[1],
-        "/": lambda l: l[0]/l[1],
-        "*": lambda l: reduce(lambda x, y: x*y, l),
-        "neg": lambda l: -l[0],
-        "-": lambda l: l[0] - l[1],
+        "/": hashcons.make_quotient,
+        "*": hashcons.make_product,
+        "neg": lambda l: hashcons.make_product([-1, l[0]]),
+        "-": lambda l: hashcons.make_sum([l[0]] + [hashcons.make_product([-1, x]) for x in l[1:]]),
         "^": lambda l: l[0] ** l[1]
     }
 
+    # Polya term for each SMT node id, so that nodes shared between assertions, or through let
+    # bindings, are translated once.
+    term_cache = {}
+    cache_stats = {'hits': 0, 'misses': 0}
+    # The Polya terms built so far, so that equal operations on the same terms, such as a
+    # subterm repeated in several assertions, give the same term object.
+    table = hashcons.TermTable()
+    # The formulas bound to Boolean let variables, by the id of the variable's node. The values
+    # of the other let variables are put in term_cache, so references to them are cache hits.
+    bound_formulas = {}
+
     def translate_term(term):
-        if term.kind in smt_to_polya_ops:
-            return smt_to_polya_ops[term.kind]([translate_term(c) for c in term.children])
+        if term.id in term_cache:
+            cache_stats['hits'] += 1
+            return term_cache[term.id]
+        cache_stats['misses'] += 1
+        t = term_cache[term.id] = translate_new_term(term)
+        return t
+
+    def translate_new_term(term):
+        if term.kind == 'let':
+            return translate_term(bind_lets(term))
+        elif term.kind in smt_to_polya_ops:
+            return table.build(term.kind, smt_to_polya_ops[term.kind],
+                               [translate_term(c) for c in term.children])
         elif term.kind == '<const dec>' or term.kind == '<const num>':
             if str(int(float(str(term)))) == str(float(str(term))):
                 return int(float(str(term)))
             else:
                 return fractions.Fraction(str(term))
         elif term.kind == '<var or fun symbol>':
-            if isinstance(term, ddsmtparser.SMTFunNode):
+            # a function application, an SMTFunAppNode or a view of one, is not is_fun()
+            if term.is_fun():
                 if term.name in funs:
-                    return funs[term.name](*[translate_term(c) for c in term.children])
+                    return apply_fun(funs[term.name], term.children)
+                elif term.name in macros:
+                    # the children of a defined symbol are its body, not arguments
+                    return instantiate(term.name, [])
                 elif term.name in vars:
                     return vars[term.name]
                 else:
                     raise Exception("unknown term name: " + str(term.name))
-            elif isinstance(term, ddsmtparser.SMTFunAppNode):
+            else:
                 #print term.children, [(c.name, c.children )for c in term.children]
                 if term.fun.name in funs:
-                    return funs[term.fun.name](*[translate_term(c) for c in term.children])
+                    return apply_fun(funs[term.fun.name], term.children)
+                elif term.fun.name in macros:
+                    return instantiate(term.fun.name, term.children)
                 elif term.fun.name in vars:
                     return vars[term.fun.name]
                 else:
@@ -73,6 +206,43 @@ def translate_smt_node(cmds, force_fm=False, force_smt=False):
             print 'didnt find kind:', term, term.kind
             return polya.Var('c')
 
+    def bind_lets(node):
+        """
+        Translates the bindings of the let node, and of the lets nested directly in its body,
+        and returns the first body that is not a let. Each bound value is translated once,
+        however often the variable is used, and nested lets are followed in a loop rather than
+        by recursion.
+        """
+        while node.kind == 'let':
+            for b in node.children[:-1]:
+                if str(b.var.sort) == 'Bool':
+                    bound_formulas[b.var.id] = translate_formula(b.children[0])
+                else:
+                    term_cache[b.var.id] = translate_term(b.children[0])
+                stats.add('let bindings')
+            node = node.children[-1]
+        return node
+
+    def apply_fun(f, children):
+        return table.build(f, lambda args: f(*args), [translate_term(c) for c in children])
+
+    def instantiate(name, children):
+        """
+        Returns the body of the defined function name with the translated children in place of
+        its parameters. Each tuple of arguments is substituted once, and later applications to
+        the same arguments share the result.
+        """
+        placeholders, body = macros[name]
+        if isinstance(body, numbers.Rational):
+            return body
+
+        def substitute(args):
+            return body.substitute(dict(
+                (v.key, polya.main.terms.STerm(a, polya.main.terms.one)
+                 if isinstance(a, numbers.Rational) else a)
+                for v, a in zip(placeholders, args)))
+        return table.build(body, substitute, [translate_term(c) for c in children])
+
     def translate_comparison(fmla):
         if fmla.kind in smt_to_polya_comps and len(fmla.children) == 2:
             return smt_to_polya_comps[fmla.kind](
@@ -82,7 +252,12 @@ def translate_smt_node(cmds, force_fm=False, force_smt=False):
             raise Exception("error in translate_comparison: " + fmla.kind + " " + len(fmla.children))
 
     def translate_formula(fmla):
-        if fmla.kind == 'not':
+        stats.add('formula nodes')
+        if fmla.kind == 'let':
+            fmla = bind_lets(fmla)
+        if fmla.id in bound_formulas:
+            return bound_formulas[fmla.id]
+        elif fmla.kind == 'not':
             return polya.Not(translate_formula(fmla.children[0]))
         elif fmla.kind == 'and':
             return polya.And(*[translate_formula(c) for c in fmla.children])
@@ -129,34 +304,57 @@ def translate_smt_node(cmds, force_fm=False, force_smt=False):
                 raise Exception('dont understand boolean type')
         elif fmla.kind in smt_to_polya_comps:
             return translate_comparison(fmla)
+        elif fmla.kind == '<var or fun symbol>':
+            name = fmla.name if fmla.is_fun() else fmla.fun.name
+            if name not in macros:
+                raise Exception('unknown Boolean symbol: ' + str(name))
+            return instantiate(name, [] if fmla.is_fun() else fmla.children)
         else:
             raise Exception('dont understand type:'+fmla.kind)
 
     def add_fun(smtfunnode):
         #print 'add_fun:', smtfunnode.name, smtfunnode.sorts, smtfunnode.sort
         if str(smtfunnode.sort) != 'Real':
-            print 'Error: wrong sort', smtfunnode.sort
-            exit()
+            raise UnsupportedSortException(
+                    'wrong sort {0} of {1}'.format(smtfunnode.sort, smtfunnode.name))
         arity = len(smtfunnode.sorts)
         if arity > 0:
             if any(str(s) != 'Real' for s in smtfunnode.sorts):
-                print 'Error: wrong sort'
-                exit()
+                raise UnsupportedSortException('wrong argument sorts of ' + smtfunnode.name)
             funs[smtfunnode.name] = polya.Func(smtfunnode.name, arity)
         else:
             vars[smtfunnode.name] = polya.Var(smtfunnode.name)
 
     def def_fun(l):
-        #print 'deffun:', l
-        #print l[0]
-        #print l[1][0]
-        #print l[2]
-        #todo : finish this
-        name, input, output = '', '', ''
-        #print 'def_fun:', name, input, output
-        add_fun(l)
-        #e.add_axiom()  # figure this part out
-        raise Exception("def_fun not supported")
+        """
+        Translates the body of a define-fun once, with a placeholder variable for each
+        parameter; applications substitute their arguments for these, see instantiate. A
+        nullary real function whose body is not a number or a variable becomes a new variable
+        equal to the body, rather than being inlined wherever it is used.
+        """
+        smtfunnode, params, body = l
+        sort = str(smtfunnode.sort)
+        if sort not in ('Real', 'Bool') or any(str(p.sort) != 'Real' for p in params):
+            raise UnsupportedSortException(
+                    'define-fun of a sort other than Real or Bool: ' + smtfunnode.name)
+        placeholders = [polya.Var('{0}#{1}'.format(smtfunnode.name, p.name)) for p in params]
+        # The parameter nodes can be shared with other definitions, so they are only bound
+        # while this body is translated.
+        for p, v in zip(params, placeholders):
+            term_cache[p.id] = v
+        try:
+            t = translate_formula(body) if sort == 'Bool' else translate_term(body)
+        finally:
+            for p in params:
+                del term_cache[p.id]
+        if params or sort == 'Bool':
+            macros[smtfunnode.name] = (placeholders, t)
+        elif isinstance(t, (numbers.Rational, polya.main.terms.Var)):
+            vars[smtfunnode.name] = t
+        else:
+            v = vars[smtfunnode.name] = polya.Var(smtfunnode.name)
+            for e in exlist:
+                e.hyps.append(v == t)
 
     def set_comment(c):
         #print 'set_comment:', c
@@ -166,7 +364,10 @@ def translate_smt_node(cmds, force_fm=False, force_smt=False):
     def make_assertion(a):
         #print 'make_assertion:', str(a[0])
         #print a[0]
-        fmla = formulas.pnf(translate_formula(a[0]))
+        stats.add('assertions')
+        fmla = translate_formula(a[0])
+        with stats.timer('pnf'):
+            fmla = formulas.pnf(fmla)
         make_translated_assertion(fmla)
 
     def var_occurs_in_clause(var, list):
@@ -220,11 +421,21 @@ def translate_smt_node(cmds, force_fm=False, force_smt=False):
                             e.clauses.append(cls)
 
         else:
-            conjuncts = formulas.dnf(fmla) # or of ands
+            with stats.timer('dnf'):
+                conjuncts = formulas.dnf(fmla) # or of ands
+            if lazy:
+                if len(conjuncts) == 1:
+                    for e in exlist:
+                        e.hyps.extend(conjuncts[0])
+                else:
+                    disjunctions.append(conjuncts)
+                return
             nexmps = []
             for e in exlist:
                 for l in conjuncts:
-                    e2 = copy.deepcopy(e)
+                    with stats.timer('deepcopy'):
+                        e2 = copy.deepcopy(e)
+                    stats.add('copies')
                     for c in l:
                         e2.hyps.append(c)
                     nexmps.append(e2)
@@ -288,11 +499,165 @@ def translate_smt_node(cmds, force_fm=False, force_smt=False):
         elif isinstance(pterm, polya.main.terms.One):
             return '1'
 
+    def count_branches():
+        return len(exlist) * reduce(lambda x, y: x * y, [len(d) for d in disjunctions], 1)
+
+    def branch(i):
+        """
+        Returns the i-th of the count_branches() Examples that must all be refuted. In lazy mode,
+        it is built from an element of exlist and one conjunct of each disjunction, chosen by
+        reading i as a mixed-radix number.
+        """
+        if not disjunctions:
+            return exlist[i]
+        choice = []
+        for d in reversed(disjunctions):
+            i, k = divmod(i, len(d))
+            choice.append(d[k])
+        with stats.timer('deepcopy'):
+            e = copy.deepcopy(exlist[i])
+        stats.add('copies')
+        for l in reversed(choice):
+            e.hyps.extend(l)
+        return e
+
+    def branches():
+        for i in xrange(count_branches()):
+            yield branch(i)
+
+    def test_in_parallel(n):
+        """
+        Tests the n branches in forked worker processes, which take the next untested branch
+        index from a shared counter. Returns False as soon as some branch is not refuted, and
+        True once all are. The workers are killed on return, also when a TimerException ends the
+        test. A worker that runs out of time raises TimerException here too. Under supervise,
+        the workers are in the process group that is killed when a limit is reached.
+        """
+        next_branch = multiprocessing.Value('l', 0)
+        answers = multiprocessing.Queue()
+
+        def work():
+            while True:
+                with next_branch.get_lock():
+                    i = next_branch.value
+                    next_branch.value += 1
+                if i >= n:
+                    break
+                try:
+                    refuted = branch(i).test()
+                except Exception as e:
+                    answers.put(('error', (type(e), str(e))))
+                    return
+                if not refuted:
+                    answers.put(('sat', i))
+                    return
+            answers.put(('done', None))
+
+        sys.stdout.flush()
+        procs = [multiprocessing.Process(target=work) for _ in range(min(workers, n))]
+        for proc in procs:
+            proc.daemon = True
+            proc.start()
+        try:
+            finished = 0
+            while finished < len(procs):
+                try:
+                    kind, value = answers.get(timeout=0.1)
+                except Queue.Empty:
+                    if not any(proc.is_alive() for proc in procs) and answers.empty():
+                        raise Exception('a disjunct worker died')
+                    continue
+                if kind == 'sat':
+                    return False
+                elif kind == 'error':
+                    cls, message = value
+                    if issubclass(cls, TimerException):
+                        raise TimerException()
+                    raise Exception(message)
+                finished += 1
+            return True
+        finally:
+            for proc in procs:
+                if proc.is_alive():
+                    proc.terminate()
+                proc.join()
+
+    def push(n):
+        for _ in range(n):
+            vars.mark()
+            funs.mark()
+            macros.mark()
+            scopes.append((list(exlist),
+                           [(len(e.hyps), len(e.axioms), len(e.clauses), e.comment)
+                            for e in exlist],
+                           len(disjunctions), len(context), shape and shape.save()))
+
+    def pop(n):
+        if n > len(scopes):
+            raise Exception('cannot pop {0} scopes, only {1} are open'.format(n, len(scopes)))
+        for _ in range(n):
+            vars.undo()
+            funs.undo()
+            macros.undo()
+            exmps, sizes, ndisjunctions, ncontext, counts = scopes.pop()
+            for e, (nhyps, naxioms, nclauses, comment) in zip(exmps, sizes):
+                del e.hyps[nhyps:]
+                del e.axioms[naxioms:]
+                del e.clauses[nclauses:]
+                e.comment = comment
+            exlist[:] = exmps
+            del disjunctions[ndisjunctions:]
+            del context[ncontext:]
+            if shape:
+                shape.restore(counts)
+
     def check_sat(a):
         polya.set_verbosity(polya.quiet)
         print '-----'
-        print 'Checking sat. disjuncts: ', len(exlist)
-        status[0] = 1 if all(e.test() for e in exlist) else -1
+        n = count_branches()
+        print 'Checking sat. disjuncts: ', n
+        stats.add('check-sats')
+        stats.add('disjuncts', n)
+        stats.add('axioms', sum(len(e.axioms) for e in exlist))
+        solver = solver_type
+        if shape:
+            values = shape.values(n)
+            if features is not None:
+                features.clear()
+                features.update(values)
+            if solver_type == 'auto':
+                solver = backend_select.choose(values)
+                polya.set_solver_type(solver)
+                print 'Solver: {0} (auto)'.format(solver)
+        stats.add('{0} check-sats'.format(solver))
+        key = None
+        # the time limit is for the whole run, and the cache keys on a single check-sat
+        budget = round(timeout - (cpu_time() - cpu_start), 3) if timeout else None
+        if result_cache:
+            key = result_cache.key(context, solver == 'fm')
+            cached = result_cache.lookup(key)
+            if cached and cached[0] != 0:
+                print 'Cached result.'
+                status[0] = cached[0]
+                print 'RESULT: 1 (UNSAT)' if status[0] == 1 else 'RESULT: -1 (POSSIBLY SAT)'
+                print '-----'
+                return
+            if cached and budget is not None and budget <= cached[1]:
+                print 'Cached result: timed out with a limit of {0} seconds.'.format(cached[1])
+                raise TimerException()
+        try:
+            with stats.timer('test'):
+                if workers > 1 and n > 1:
+                    refuted = test_in_parallel(n)
+                else:
+                    refuted = all(e.test() for e in branches())
+        except TimerException:
+            if key and budget is not None:
+                result_cache.store_timeout(key, budget)
+            raise
+        status[0] = 1 if refuted else -1
+        if key:
+            result_cache.store(key, status[0])
         print 'RESULT: 1 (UNSAT)' if status[0] == 1 else 'RESULT: -1 (POSSIBLY SAT)'
         print '-----'
 
@@ -303,12 +668,12 @@ def translate_smt_node(cmds, force_fm=False, force_smt=False):
             t = translate_term(a[0])
             if isinstance(t, numbers.Rational):
                 t = polya.main.terms.STerm(t, polya.main.terms.One())
-            status[0] = t.canonize()
+            status[0] = table.canonize(t)
         else:
             t = translate_term(a[0])
             if isinstance(t, numbers.Rational):
                 t = polya.main.terms.STerm(t, polya.main.terms.One())
-            status[0] = polya_to_smt(t.canonize())
+            status[0] = polya_to_smt(table.canonize(t))
         print status[0]
         print '-----'
 
@@ -319,8 +684,8 @@ def translate_smt_node(cmds, force_fm=False, force_smt=False):
         p.DECLSORT: lambda x: None,  # do this one
         p.DECLFUN: lambda smtfunnode: add_fun(smtfunnode[0]),
         p.DEFFUN: lambda list: def_fun(list),
-        p.POP: lambda x: None,
-        p.PUSH: lambda x: None,
+        p.POP: pop,
+        p.PUSH: push,
         p.ASSERT: make_assertion,
         p.CHECKSAT: check_sat,
         p.GETASSERT: lambda x: None,
@@ -335,6 +700,26 @@ def translate_smt_node(cmds, force_fm=False, force_smt=False):
 
     }
 
-    for c in cmds:
-        map[c.kind](c.children)
+    stats.add('files')
+    stats.start('translate')
+    try:
+        for c in stats.timed('parse', cmds):
+            stats.add('commands')
+            if result_cache and c.kind in (p.DECLFUN, p.DEFFUN, p.ASSERT):
+                context.append(str(c))
+            if shape and c.kind == p.DECLFUN:
+                shape.add_fun(c.children[0])
+            elif shape and c.kind == p.ASSERT:
+                shape.add_assertion(c.children[0])
+            elif shape and c.kind == p.DEFFUN:
+                shape.add_assertion(c.children[2])
+            if c.kind in (p.PUSH, p.POP):
+                map[c.kind](c.nscopes)
+            else:
+                map[c.kind](c.children)
+    finally:
+        stats.stop()
+        stats.add('term nodes', cache_stats['misses'])
+        stats.add('term cache hits', cache_stats['hits'])
+        stats.add('shared terms', table.hits)
     return status[0]
\ No newline at end of file
@@ -0,0 +1,97 @@
+"""
+Builds backend_model.json, the decision list backend_select uses to choose a solver, from the
+logs batch_translate.poly_fm_compare writes.
+
+Each problem is labelled with the solver that proved it unsatisfiable, or the faster of the two
+if both did; problems neither solved are left out. The default is the majority label, and
+rules are then added greedily, each the single threshold on one feature that solves the most
+problems when put in front of the default, until no rule helps.
+
+Usage:
+  python train_backend_model.py [-o backend_model.json] log.jsonl [log.jsonl ...]
+"""
+import argparse
+import json
+
+import backend_select
+
+min_support = 3  # A rule must decide at least this many problems.
+max_rules = 8
+
+
+def label(entry):
+    poly, fm = entry['poly'] == 1, entry['fm'] == 1
+    if poly and fm:
+        return 'poly' if entry['poly_time'] <= entry['fm_time'] else 'fm'
+    elif poly:
+        return 'poly'
+    elif fm:
+        return 'fm'
+    return None
+
+
+def accuracy(model, examples):
+    return sum(backend_select.choose(values, model) == l for values, l in examples)
+
+
+def train(examples):
+    """
+    Returns a model for the list of (feature values, label) pairs.
+    """
+    labels = [l for _, l in examples]
+    model = {'features': backend_select.FEATURES, 'rules': [],
+             'default': max(['poly', 'fm'], key=labels.count)}
+    best = accuracy(model, examples)
+    while len(model['rules']) < max_rules:
+        candidates = []
+        for f in backend_select.FEATURES:
+            for t in sorted(set(values[f] for values, _ in examples)):
+                for op in ('>', '<='):
+                    covered = [l for values, l in examples if (values[f] > t) == (op == '>')]
+                    if len(covered) < min_support:
+                        continue
+                    for solver in ('poly', 'fm'):
+                        rule = {'feature': f, 'op': op, 'threshold': t, 'solver': solver}
+                        candidates.append(rule)
+        scored = []
+        for rule in candidates:
+            m = dict(model, rules=model['rules'] + [rule])
+            scored.append((accuracy(m, examples), rule))
+        if not scored:
+            break
+        score, rule = max(scored, key=lambda s: s[0])
+        if score <= best:
+            break
+        model['rules'].append(rule)
+        best = score
+    return model, best
+
+
+def read_logs(paths):
+    examples = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                entry = json.loads(line)
+                l = label(entry)
+                if l:
+                    examples.append((entry['features'], l))
+    return examples
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Train the backend selection model.")
+    parser.add_argument('logs', nargs='+', help="logs written by poly_fm_compare")
+    parser.add_argument('-o', dest='output', default=backend_select.default_model_file,
+                        help="where to write the model (default: {0})".format(
+                            backend_select.default_model_file))
+    args = parser.parse_args()
+    examples = read_logs(args.logs)
+    if not examples:
+        parser.error("no problem in the logs was solved by either solver")
+    model, score = train(examples)
+    with open(args.output, 'w') as f:
+        json.dump(model, f, indent=2, separators=(',', ': '), sort_keys=True)
+        f.write('\n')
+    print 'Chose the better solver for {0} of {1} problems with {2} rules.'.format(
+        score, len(examples), len(model['rules']))